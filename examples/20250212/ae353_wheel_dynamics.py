@@ -0,0 +1,28 @@
+import numpy as np
+
+
+def integrate_wheel(q, v, tau, dt, inertia, mass, damping, roll, marker_radius, maximum_joint_velocity):
+    """
+    returns the wheel angle and velocity after one time step of length dt,
+    starting from angle q and velocity v with applied torque tau - works the
+    same with scalars (one wheel) or arrays (one element for each wheel)
+    """
+
+    # Coefficients of the equation of motion
+    #
+    #   J * a = tau - m * g * r * sin(roll) * sin(q) - damping * v
+    #
+    # where J is the moment of inertia about the axis of rotation (wheel
+    # plus marker) - like pybullet, the damping torque is evaluated once
+    # at the start of each time step and held constant over all substeps
+    J = inertia + mass * marker_radius**2
+    a_tau = (tau - damping * v) / J
+    a_gravity = mass * 9.81 * marker_radius * np.sin(roll) / J
+
+    # Semi-implicit Euler with the same fixed time step and number of
+    # substeps as pybullet
+    h = dt / 4
+    for i in range(4):
+        v = np.minimum(np.maximum(v + h * (a_tau - a_gravity * np.sin(q)), -maximum_joint_velocity), maximum_joint_velocity)
+        q = q + h * v
+    return q, v
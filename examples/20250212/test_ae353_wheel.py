@@ -0,0 +1,56 @@
+from pathlib import Path
+import numpy as np
+import pytest
+
+import ae353_wheel
+
+
+class Controller:
+    def __init__(self, K):
+        self.K = K
+
+    def reset(self):
+        pass
+
+    def run(self, t, wheel_angle, wheel_velocity, target_angle):
+        return - (self.K[0] * (wheel_angle - target_angle) + self.K[1] * wheel_velocity)
+
+
+@pytest.fixture(autouse=True)
+def run_in_example_directory(monkeypatch):
+    # The simulator loads its URDF files relative to the current directory
+    monkeypatch.chdir(Path(__file__).resolve().parent)
+
+
+@pytest.mark.parametrize('wheel_angle, wheel_velocity', [
+    (None, None),
+    (0.5, None),
+    (None, -0.2),
+])
+def test_batch_reset_is_same_as_simulator_reset(wheel_angle, wheel_velocity):
+    seeds = [3, 4, 5]
+    batch = ae353_wheel.BatchSimulator(len(seeds), seed=seeds)
+    batch.reset(wheel_angle=wheel_angle, wheel_velocity=wheel_velocity)
+    for i, seed in enumerate(seeds):
+        simulator = ae353_wheel.Simulator(display=False, seed=seed, backend='numpy')
+        simulator.reset(wheel_angle=wheel_angle, wheel_velocity=wheel_velocity)
+        assert batch.q[i] == simulator.q
+        assert batch.v[i] == simulator.v
+
+
+def test_batch_run_is_same_as_simulator_run():
+    K = np.array([[1., 1.], [20., 3.], [100., 0.5]])
+    target = lambda t: 1. if t > 1. else 0.
+    parameters = {'roll': 0.3, 'damping': 0.1, 'mass': 0.5, 'tau_max': 2.}
+
+    batch = ae353_wheel.BatchSimulator(len(K), seed=[0, 1, 2], **parameters)
+    batch.reset()
+    batch_data = batch.run(ae353_wheel.LinearController(K), target, max_time=3.)
+
+    for i in range(len(K)):
+        simulator = ae353_wheel.Simulator(display=False, seed=i, backend='numpy', **parameters)
+        simulator.reset()
+        data = simulator.run(Controller(K[i]), target, max_time=3.)
+        assert np.array_equal(data['t'], batch_data['t'])
+        for key in ['wheel_angle', 'wheel_velocity', 'wheel_torque', 'wheel_torque_command']:
+            assert np.array_equal(data[key], batch_data[key][:, i])
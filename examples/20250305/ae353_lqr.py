@@ -0,0 +1,211 @@
+import numpy as np
+from scipy import linalg
+from collections import OrderedDict
+
+
+class LRUCache:
+    """
+    Remembers the values of at most maxsize keys, forgetting the one that was
+    least recently used when full. This module is imported only once by the
+    bokeh server, so one cache is shared by every session (i.e., every student
+    who has the app open).
+    """
+
+    def __init__(self, maxsize=256):
+        self.maxsize = maxsize
+        self.values = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, compute):
+        """
+        returns the value of key, calling compute() to find it if necessary
+        """
+        if key in self.values:
+            self.hits += 1
+            self.values.move_to_end(key)
+            return self.values[key]
+        self.misses += 1
+        value = compute()
+        self.values[key] = value
+        if len(self.values) > self.maxsize:
+            self.values.popitem(last=False)
+        return value
+
+    def clear(self):
+        self.values.clear()
+        self.hits = 0
+        self.misses = 0
+
+
+def get_key(*args):
+    """
+    returns a hashable key for any number of scalars and numpy arrays
+    """
+    key = []
+    for arg in args:
+        arg = np.asarray(arg, dtype=float)
+        key.append((arg.shape, arg.tobytes()))
+    return tuple(key)
+
+
+class UpdateScheduler:
+    """
+    Runs update() at most once per tick of the bokeh server, no matter how
+    many widgets change (e.g., while dragging a slider). Changes made while
+    update() is running (e.g., to a slider that shows the result of solving
+    LQR) are ignored, so update() never triggers itself.
+
+    Use schedule as the on_change callback of each widget. Create one
+    scheduler for each document (i.e., in the app itself, which runs once
+    for each session).
+    """
+
+    def __init__(self, doc, update):
+        self.doc = doc
+        self.update = update
+        self.is_scheduled = False
+        self.is_running = False
+
+    def schedule(self, attrname, old, new):
+        if self.is_running or self.is_scheduled:
+            return
+        self.is_scheduled = True
+        self.doc.add_next_tick_callback(self.run)
+
+    def run(self):
+        self.is_scheduled = False
+        self.is_running = True
+        try:
+            self.update()
+        finally:
+            self.is_running = False
+
+
+# Caches of results that depend on (Q, R) (the solution to LQR) and on K (the
+# closed-loop response and cost) - none depend on the initial condition, so
+# changing only the initial condition recomputes nothing
+lqr_cache = LRUCache(maxsize=256)
+response_cache = LRUCache(maxsize=256)
+cost_at_infinity_cache = LRUCache(maxsize=4096)
+
+
+def lqr(A, B, Q, R):
+    def compute():
+        P = linalg.solve_continuous_are(A, B, Q, R)
+        K = linalg.inv(R) @  B.T @ P
+        return K, P
+    return lqr_cache.get(get_key(A, B, Q, R), compute)
+
+def get_cost_matrix_at_infinity(A, B, Q, R, K):
+    """
+    returns the solution W to the Lyapunov equation
+
+        (A - BK)^T W + W (A - BK) + (Q + K^T R K) = 0
+
+    if A - BK is stable, and None otherwise
+    """
+    def compute():
+        F = A - B @ K
+        if not (np.linalg.eigvals(F).real < 0).all():
+            return None
+        return linalg.solve_continuous_lyapunov(F.T, -(Q + K.T @ R @ K))
+    return cost_at_infinity_cache.get(get_key(A, B, Q, R, K), compute)
+
+def get_cost_at_infinity(A, B, Q, R, K, x0):
+    """
+    returns the total cost
+
+        int_0^infty (x(t)^T Q x(t) + u(t)^T R u(t)) dt
+
+    of the closed-loop system xdot = (A - BK)x, u = -Kx, x(0) = x0 - this is
+    x0^T W x0 (see get_cost_matrix_at_infinity) if A - BK is stable, and is
+    infinite otherwise
+    """
+    W = get_cost_matrix_at_infinity(A, B, Q, R, K)
+    if W is None:
+        return np.inf
+    return (x0.T @ W @ x0).item()
+
+def get_closed_loop_response(A, B, Q, R, K, dt):
+    """
+    returns a ClosedLoopResponse, reusing one that was found before if possible
+    """
+    return response_cache.get(
+        get_key(A, B, Q, R, K, dt),
+        lambda: ClosedLoopResponse(A, B, Q, R, K, dt),
+    )
+
+
+class ClosedLoopResponse:
+    """
+    Response of the closed-loop system
+
+        xdot = (A - BK)x    u = -Kx
+
+    at nt evenly spaced times (dt apart) starting from t = 0, along with the
+    cost of this response. Everything that does not depend on the initial
+    condition is computed here, once, so that finding the response from a
+    new initial condition takes no more than nt small matrix products.
+
+    One matrix exponential (Van Loan's method) gives both the state transition
+    matrix over one time step
+
+        Phi = e^{(A - BK) dt}
+
+    and the cost incurred over one time step from each state x
+
+        x^T G x    where    G = int_0^dt e^{(A - BK)^T s} (Q + K^T R K) e^{(A - BK) s} ds
+    """
+
+    def __init__(self, A, B, Q, R, K, dt):
+        self.A = A
+        self.B = B
+        self.Q = Q
+        self.R = R
+        self.K = K
+        self.dt = dt
+
+        # Closed-loop eigenvalues
+        F = A - B @ K
+        self.eigenvalues = np.linalg.eigvals(F)
+
+        # State transition matrix and cost over one time step
+        n = F.shape[0]
+        M = np.block([
+            [-F.T, Q + K.T @ R @ K],
+            [np.zeros((n, n)), F],
+        ])
+        E = linalg.expm(M * dt)
+        self.Phi = E[n:, n:]
+        self.G = self.Phi.T @ E[:n, n:]
+
+    def get_state(self, x0, nt):
+        """
+        returns an array with one row for each time and one column for each state
+        """
+        x = np.empty((nt, len(x0)))
+        x[0] = x0
+        for i in range(1, nt):
+            x[i] = self.Phi @ x[i - 1]
+        return x
+
+    def get_input(self, x):
+        """
+        returns an array with one row for each time and one column for each input
+        """
+        return - x @ self.K.T
+
+    def get_cost(self, x):
+        """
+        returns an array with the cost from time 0 to each time
+        """
+        cost = np.zeros(x.shape[0])
+        cost[1:] = np.cumsum(np.einsum('ij,jk,ik->i', x[:-1], self.G, x[:-1]))
+        return cost
+
+    def get_cost_at_infinity(self, x0):
+        """
+        returns the total cost (see get_cost_at_infinity)
+        """
+        return get_cost_at_infinity(self.A, self.B, self.Q, self.R, self.K, x0)
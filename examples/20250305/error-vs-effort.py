@@ -5,12 +5,11 @@ bokeh serve error-vs-effort.py
 """
 
 import numpy as np
-from scipy import integrate
-from scipy import linalg
 from bokeh.io import curdoc
 from bokeh.layouts import column, row, Spacer
 from bokeh.models import Slider, Checkbox, Div, Title
 from bokeh.plotting import figure
+from ae353_lqr import lqr, get_cost_at_infinity, get_closed_loop_response, UpdateScheduler
 
 colors = {
     'illini_orange': '#FF5F05',
@@ -25,19 +24,10 @@ colors = {
     'heritage_orange_light': '#F5821E',
 }
 
-def integrand(t, a, b, q, r, k, x0, t0):
-    x = np.exp((a - b * k) * (t - t0)) * x0
-    u = - k * x
-    return q * x**2 + r * u**2
-
-def get_cost(a, b, q, r, k, x0, t0, t1):
-    cost, err = integrate.quad(integrand, t0, t1, args=(a, b, q, r, k, x0, t0))
-    return cost
-
-def lqr(A, B, Q, R):
-    P = linalg.solve_continuous_are(A, B, Q, R)
-    K = linalg.inv(R) @  B.T @ P
-    return K, P
+def get_cost(a, b, q, r, k, x0):
+    return get_cost_at_infinity(
+        np.array([[a]]), np.array([[b]]), np.array([[q]]), np.array([[r]]), np.array([[k]]), np.array([x0]),
+    )
 
 # Widgets
 styles = {"font-size": "150%"}
@@ -100,6 +90,9 @@ q_lab = Div(text='', styles=div_style, align='center')
 r_lab = Div(text='', styles=div_style, align='center')
 
 def update_data_p(attrname, old, new):
+    # Ignore changes made by update_data_k (which keeps ps in sync with ks)
+    if scheduler.is_running:
+        return
     ks.value = 5. - ps.value
 
 def update_data_k(attrname, old, new):
@@ -128,19 +121,19 @@ def update_data_k(attrname, old, new):
     # Get the state, input, and cost as functions of time
     x = np.exp((a - b * k) * (t - t0)) * x0
     u = - k * x
-    cost = np.array([get_cost(a, b, q, r, k, x0, t0, t1) for t1 in t])
+    response = get_closed_loop_response(
+        np.array([[a]]), np.array([[b]]), np.array([[q]]), np.array([[r]]), np.array([[k]]), t[1] - t[0],
+    )
+    cost = response.get_cost(x[:, np.newaxis])
 
     # Get the cost at infinity
-    if (a - b * k) < 0:
-        cost_at_infinity = get_cost(a, b, q, r, k, x0, t0, np.inf)
-    else:
-        cost_at_infinity = np.inf
+    cost_at_infinity = get_cost(a, b, q, r, k, x0)
     
     # Get the cost at infinity as a function of k (if desired)
     c_list = -np.ones_like(k_list)
     if show_costs.active:
         for i, k_cur in enumerate(k_list):
-            c_list[i] = get_cost(a, b, q, r, k_cur, x0, t0, np.inf)
+            c_list[i] = get_cost(a, b, q, r, k_cur, x0)
     
     s_plt.data_source.data = dict(x=[s.real], y=[s.imag])
     x_plt.data_source.data['y'] = x
@@ -151,19 +144,23 @@ def update_data_k(attrname, old, new):
     costs_at_infinity_plt.data_source.data['x'] = k_list
     costs_at_infinity_plt.data_source.data['y'] = c_list
 
+# Update at most once per tick of the bokeh server (see UpdateScheduler)
+doc = curdoc()
+scheduler = UpdateScheduler(doc, lambda: update_data_k(None, None, None))
+
 # Initialize everything
 update_data_k(None, None, None)
 
 # Set a callback for each widget
 for w in [ks, x0s, qs, rs]:
-    w.on_change('value', update_data_k)
+    w.on_change('value', scheduler.schedule)
 for w in [solve_lqr, show_costs]:
-    w.on_change('active', update_data_k)
+    w.on_change('active', scheduler.schedule)
 for w in [ps]:
     w.on_change('value', update_data_p)
 
 # Specify layout
-curdoc().add_root(
+doc.add_root(
     column(
         row(Spacer(), height=20),
         row(
@@ -193,4 +190,4 @@ curdoc().add_root(
         width=2000,
     )
 )
-curdoc().title = "LQR Demo"
\ No newline at end of file
+doc.title = "LQR Demo"
\ No newline at end of file
@@ -5,12 +5,11 @@ bokeh serve lqr-wheel.py
 """
 
 import numpy as np
-from scipy import integrate
-from scipy import linalg
 from bokeh.io import curdoc
 from bokeh.layouts import column, row, Spacer
 from bokeh.models import Slider, Checkbox, Div, Title
 from bokeh.plotting import figure
+from ae353_lqr import lqr, get_closed_loop_response, UpdateScheduler
 
 colors = {
     'illini_orange': '#FF5F05',
@@ -25,20 +24,6 @@ colors = {
     'heritage_orange_light': '#F5821E',
 }
 
-def integrand(t, A, B, Q, R, K, x0, t0):
-    x = linalg.expm((A - B @ K) * (t - t0)) @ x0
-    u = - K @ x
-    return (x.T @ Q @ x + u.T @ R @ u).item()
-
-def get_cost(A, B, Q, R, K, x0, t0, t1):
-    cost, err = integrate.quad(integrand, t0, t1, args=(A, B, Q, R, K, x0, t0))
-    return cost
-
-def lqr(A, B, Q, R):
-    P = linalg.solve_continuous_are(A, B, Q, R)
-    K = linalg.inv(R) @  B.T @ P
-    return K, P
-
 # Parameters that define the state-space model (wheel in gravity)
 A = np.array([[0., 1.], [2., 0.]])
 B = np.array([[0.], [1.]])
@@ -130,18 +115,15 @@ def update_data_k(attrname, old, new):
         k1_slider.disabled = False
         k2_slider.disabled = False
 
+    # Get the closed-loop response
+    response = get_closed_loop_response(A, B, Q, R, K, t[1] - t[0])
+
     # Get the closed-loop eigenvalue
-    s = np.linalg.eigvals(A - B @ K)
+    s = response.eigenvalues
     
-    # Get the state, input, and cost as functions of time
-    x = []
-    u = []
-    for t1 in t:
-        x1 = linalg.expm((A - B @ K) * (t1 - t0)) @ x0
-        x.append(x1)
-        u.append(- K @ x1)
-    x = np.array(x)
-    u = np.array(u)
+    # Get the state and input as functions of time
+    x = response.get_state(x0, nt)
+    u = response.get_input(x)
     
     # Get the cost at infinity
     if solve_lqr.active:
@@ -150,7 +132,7 @@ def update_data_k(attrname, old, new):
         formula = r'& \mathmakebox[5em][l]{{\phantom{{\qquad = x(0)^T P x(0)}}}} \\[.5em]'
     
     if (s.real < 0).all():
-        cost_at_infinity = get_cost(A, B, Q, R, K, x0, t0, np.inf)
+        cost_at_infinity = response.get_cost_at_infinity(x0)
         cost = fr'& \qquad = {cost_at_infinity:.2f} \qquad \text{{(total cost)}}'
         if solve_lqr.active:
             assert(np.isclose(cost_at_infinity, (x0.T @ P @ x0).item()))
@@ -173,17 +155,21 @@ def update_data_k(attrname, old, new):
     x2_plt.data_source.data = dict(x=t, y=x[:, 1])
     u1_plt.data_source.data = dict(x=t, y=u[:, 0])
 
+# Update at most once per tick of the bokeh server (see UpdateScheduler)
+doc = curdoc()
+scheduler = UpdateScheduler(doc, lambda: update_data_k(None, None, None))
+
 # Initialize everything
 update_data_k(None, None, None)
 
 # Set a callback for each widget
 for w in [k1_slider, k2_slider, x1i_slider, x2i_slider, q1_slider, q2_slider, r1_slider]:
-    w.on_change('value', update_data_k)
+    w.on_change('value', scheduler.schedule)
 for w in [solve_lqr]:
-    w.on_change('active', update_data_k)
+    w.on_change('active', scheduler.schedule)
 
 # Specify layout
-curdoc().add_root(
+doc.add_root(
     column(
         row(Spacer(), height=20),
         row(
@@ -212,4 +198,4 @@ curdoc().add_root(
         width=2000,
     )
 )
-curdoc().title = "LQR Demo"
+doc.title = "LQR Demo"
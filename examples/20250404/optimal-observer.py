@@ -55,14 +55,54 @@ If `simulator.use_euler=True`, then the simulator class will apply Euler integra
 If `simulator.use_euler=False`, then the simulator class will integrate the observer equation "exactly" (e.g., with a Runge-Kutta solver).
 
 Note that, in either case, the simulator class shifts the state estimate forward by one time step so that, when we plot the results, we emphasize the association between the output (i.e., the sensor measurements) and the state estimates.
+
+Each call to `run_sim` draws `simulator.number_of_realizations` different disturbances and sensor noises at once, so we can plot the distribution of estimate errors. The first of these is the one that gets plotted as x, y, and xhat.
+
+The input is constant over each time step, so both the system and the observer are linear recurrences of the form
+
+x[i + 1] = Ad x[i] + Bd u[i]
+
+which (for a system with one state, like this one) are computed for all time steps and all realizations at once as a linear filter.
 """
 
+def discretize(A, B, dt):
+    """
+    returns Ad, Bd for the system xdot = Ax + Bu when u is constant over each
+    time step of length dt (the same as lsim does with interp=False)
+    """
+    n = A.shape[0]
+    m = B.shape[1]
+    M = np.zeros((n + m, n + m))
+    M[:n, :n] = A
+    M[:n, n:] = B
+    E = linalg.expm(M * dt)
+    return E[:n, :n], E[:n, n:]
+
+def run_recurrence(Ad, w, x0):
+    """
+    returns x with x[:, 0] = x0 and x[:, i + 1] = Ad x[:, i] + w[:, i], where
+    each row is one realization and each column is one time step (for a system
+    with one state - Ad must be 1x1 - so this is a linear filter)
+    """
+    w = np.atleast_2d(w)
+    x = np.empty((w.shape[0], w.shape[1] + 1))
+    x[:, 0] = x0
+    x[:, 1:], _ = signal.lfilter(
+        [1.],
+        [1., -Ad.item()],
+        w,
+        axis=1,
+        zi=Ad.item() * x[:, :1],
+    )
+    return x
+
 class Simulator:
-    def __init__(self, t0=0., t1=5., dt=0.04, seed=None):
+    def __init__(self, t0=0., t1=5., dt=0.04, seed=None, number_of_realizations=200):
         self.t0 = t0
         self.t1 = t1
         self.dt = dt
         self.rng = np.random.default_rng(seed)
+        self.number_of_realizations = number_of_realizations
         
         self.A = np.array([[0.]])
         self.B = np.array([[1.]])
@@ -84,37 +124,38 @@ class Simulator:
         self.nt = len(self.t)
     
     def run_sim(self):
+        # Draw disturbances and sensor noises (one row for each realization)
+        m = self.number_of_realizations
         self.u = self.u_avg * np.ones((self.nt, 1))
-        self.d = self.d_std * self.rng.standard_normal((self.nt, 1))
-        self.n = self.n_std * self.rng.standard_normal((self.nt, 1))
-        _, y, x = signal.lsim(
-            (self.A, self.B, self.C, self.D),
-            (self.u + self.d).flatten(),
-            self.t,
-            X0=self.x0,
-            interp=False,
-        )
-        self.y = np.reshape(y, (-1, 1)) + self.n
-        self.x = np.reshape(x, (-1, 1))
+        self.d_all = self.d_std * self.rng.standard_normal((m, self.nt))
+        self.n_all = self.n_std * self.rng.standard_normal((m, self.nt))
+
+        # Simulate all realizations at once
+        Ad, Bd = discretize(self.A, self.B, self.dt)
+        self.x_all = run_recurrence(Ad, Bd.item() * (self.u[:-1, 0] + self.d_all[:, :-1]), self.x0.item())
+        self.y_all = self.C.item() * self.x_all + self.n_all
+
+        # Keep the first realization to plot
+        self.d = np.reshape(self.d_all[0], (-1, 1))
+        self.n = np.reshape(self.n_all[0], (-1, 1))
+        self.x = np.reshape(self.x_all[0], (-1, 1))
+        self.y = np.reshape(self.y_all[0], (-1, 1))
     
     def run_obs(self):
+        # Observer as xhat[i + 1] = Ad xhat[i] + Bd [u[i], y[i]]
         if self.use_euler:
-            xhat = np.empty((self.nt + 1, 1))
-            xhat[0] = self.xhat0
-            for i in range(self.nt):
-                xhat[i + 1] = xhat[i] + self.dt * (self.A @ xhat[i] + self.B @ self.u[i] \
-                                                   - self.L @ (self.C @ xhat[i] - self.y[i]))
-            self.xhat = xhat[:-1, :]
-            
+            Ad = np.eye(1) + self.dt * (self.A - self.L @ self.C)
+            Bd = self.dt * np.hstack([self.B, self.L])
         else:
-            _, _, xhat = signal.lsim(
-                (self.A - self.L @ self.C, np.hstack([self.B, self.L]), self.C, np.zeros((1, 2))),
-                np.vstack([self.u.flatten(), self.y.flatten()]).T,
-                self.t,
-                X0=self.xhat0,
-                interp=False,
-            )
-            self.xhat = np.reshape(xhat, (-1, 1))
+            Ad, Bd = discretize(self.A - self.L @ self.C, np.hstack([self.B, self.L]), self.dt)
+
+        # Estimate the state in all realizations at once
+        self.xhat_all = run_recurrence(
+            Ad,
+            Bd[0, 0] * self.u[:-1, 0] + Bd[0, 1] * self.y_all[:, :-1],
+            self.xhat0.item(),
+        )
+        self.xhat = np.reshape(self.xhat_all[0], (-1, 1))
 
 # Create an instance of the simulator
 simulator = Simulator()
@@ -167,7 +208,25 @@ x_plt_y = x_fig.scatter(
     size=6,
     legend_label='output (y)',
 )
-for f in [x_fig]:
+e_fig = figure(
+                height=320, width=640,
+                x_range=(simulator.t0, simulator.t1), y_range=(-1, 1), x_axis_label='time (seconds)')
+e_plt_band = e_fig.varea(
+    x=simulator.t[0:-1],
+    y1=np.zeros_like(simulator.t[0:-1]),
+    y2=np.zeros_like(simulator.t[0:-1]),
+    fill_color='coral',
+    fill_alpha=0.3,
+    legend_label=f'error (mean ± 2 std over {simulator.number_of_realizations} realizations)',
+)
+e_plt_mean = e_fig.line(
+    simulator.t[0:-1],
+    np.zeros_like(simulator.t[0:-1]),
+    line_width=4,
+    line_color='coral',
+    legend_label='error (mean)',
+)
+for f in [x_fig, e_fig]:
     f.xaxis.major_label_text_font_size = major_label_text_font_size
     f.yaxis.major_label_text_font_size = major_label_text_font_size
     f.xaxis.axis_label_text_font_size = axis_label_text_font_size
@@ -212,8 +271,15 @@ def run_obs():
     simulator.run_obs()
     if simulator.shift_time:
         x_plt_xhat.data_source.data['y'] = simulator.xhat.flatten()[1:]
+        e = simulator.xhat_all[:, 1:] - simulator.x_all[:, :-1]
     else:
         x_plt_xhat.data_source.data['y'] = simulator.xhat.flatten()[:-1]
+        e = simulator.xhat_all[:, :-1] - simulator.x_all[:, :-1]
+    e_mean = np.mean(e, axis=0)
+    e_std = np.std(e, axis=0)
+    e_plt_band.data_source.data['y1'] = e_mean - 2 * e_std
+    e_plt_band.data_source.data['y2'] = e_mean + 2 * e_std
+    e_plt_mean.data_source.data['y'] = e_mean
     
 def run_sim():
     simulator.run_sim()
@@ -299,7 +365,7 @@ curdoc().add_root(
                 spacing=10,
             ),
             column(Spacer(width=50)),
-            column(x_fig, sizing_mode='stretch_width'),
+            column(x_fig, e_fig, sizing_mode='stretch_width'),
             sizing_mode='stretch_both',
         ),
         sizing_mode='stretch_both',
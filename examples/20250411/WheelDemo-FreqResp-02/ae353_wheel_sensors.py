@@ -2,10 +2,11 @@ import numpy as np
 import pybullet
 from pybullet_utils import bullet_client
 import time
-import json
-import importlib
 import meshcat
 from pathlib import Path
+from ae353_actuators import TorqueActuators
+from ae353_core import DataLogger, RealTimePacer, run_loop, wxyz_from_xyzw, convert_color
+from ae353_wheel_dynamics import integrate_wheel
 
 
 
@@ -24,6 +25,7 @@ class Simulator:
                 inertia=1.,
                 tau_max=5.,
                 sensor_noise=0.,
+                backend='pybullet',
             ):
 
         # Random number generator
@@ -36,6 +38,9 @@ class Simulator:
         # Time step
         self.dt = 0.01
 
+        # Real-time pacing (used only when displaying)
+        self.pacer = RealTimePacer(self.dt, sleep_fraction=0.9)
+
         # Other parameters
         self.damping = damping
         self.roll = roll
@@ -43,6 +48,12 @@ class Simulator:
         self.inertia = inertia
         self.sensor_noise = sensor_noise
 
+        # Physics backend ('pybullet' or 'numpy' - the latter integrates the
+        # same equations of motion directly and uses pybullet only to draw)
+        if backend not in ['pybullet', 'numpy']:
+            raise Exception(f'Invalid backend "{backend}" (choose "pybullet" or "numpy")')
+        self.backend = backend
+
         # Connect to and configure pybullet
         self.display_pybullet = display_pybullet
         self.display_meshcat = display
@@ -114,12 +125,32 @@ class Simulator:
         # Maximum applied torque
         self.tau_max = tau_max
 
+        # Prepare to apply torque commands to each joint
+        self.actuators = TorqueActuators(
+            self.bullet_client,
+            self.wheel_id,
+            self.joint_ids,
+            ['tau_desired'],
+            self.tau_max,
+        )
+
         # Set moment of inertia of wheel about its axis of rotation
         self.set_inertia(inertia)
 
         # Set mass of marker
         self.set_mass(mass)
 
+        # Initialize state of numpy backend
+        # - position of marker relative to axis of rotation (from URDF)
+        self.marker_radius = np.linalg.norm(self.bullet_client.getJointInfo(self.wheel_id, 2)[14][0:2])
+        # - wheel angle and velocity
+        self.q = 0.
+        self.v = 0.
+        # - applied torque
+        self.tau = 0.
+        # - joint speed limit (pybullet default)
+        self.maximum_joint_velocity = 100.
+
         # Initialize meshcat if necessary
         if self.display_meshcat:
             self.meshcat_init()
@@ -161,17 +192,10 @@ class Simulator:
         self.bullet_client.changeDynamics(self.wheel_id, 1, localInertiaDiagonal=[0.5, 0.5, self.inertia])
     
     def _wxyz_from_xyzw(self, xyzw):
-        return np.roll(xyzw, 1)
+        return wxyz_from_xyzw(xyzw)
 
     def _convert_color(self, rgba):
-        color = int(rgba[0] * 255) * 256**2 + int(rgba[1] * 255) * 256 + int(rgba[2] * 255)
-        opacity = rgba[3]
-        transparent = opacity != 1.0
-        return {
-            'color': color,
-            'opacity': opacity,
-            'transparent': transparent,
-        }
+        return convert_color(rgba)
 
     def meshcat_init(self):
         # Create a visualizer
@@ -239,6 +263,9 @@ class Simulator:
         #        this function more efficient.
         #
 
+        # Copy state from numpy backend (if necessary)
+        self._sync_pybullet()
+
         # Set pose of plane base
         pos_and_ori = self.bullet_client.getBasePositionAndOrientation(self.plane_id)
         pos = pos_and_ori[0]
@@ -259,33 +286,28 @@ class Simulator:
             self.vis['wheel'][link['name']].set_transform(T @ S)
 
     def get_state(self):
+        if self.backend == 'numpy':
+            return self.q, self.v
         joint_states = self.bullet_client.getJointStates(self.wheel_id, self.joint_ids)
         wheel_angle = joint_states[0][0]
         wheel_velocity = joint_states[0][1]
         return wheel_angle, wheel_velocity
 
     def get_sensor_measurements(self):
-        joint_states = self.bullet_client.getJointStates(self.wheel_id, self.joint_ids)
-        wheel_angle = joint_states[0][0]
+        wheel_angle, wheel_velocity = self.get_state()
         return wheel_angle + self.sensor_noise * self.rng.standard_normal()
 
     def set_actuator_commands(self, tau_desired):
-        assert(np.isscalar(tau_desired))
-        tau = np.clip(tau_desired, -self.tau_max, self.tau_max)
-        self.set_joint_torque(np.array([tau]))
-        return tau
+        tau = self.actuators.clip((tau_desired,))
+        self.set_joint_torque(tau)
+        return tau[0]
 
     def set_joint_torque(self, tau):
         assert(tau.shape[0] == self.num_joints)
-        zero_gains = tau.shape[0] * (0.,)
-        self.bullet_client.setJointMotorControlArray(
-            self.wheel_id,
-            self.joint_ids,
-            self.bullet_client.TORQUE_CONTROL,
-            forces=tau,
-            positionGains=zero_gains,
-            velocityGains=zero_gains
-        )
+        if self.backend == 'numpy':
+            self.tau = float(tau[0])
+            return
+        self.actuators.set_joint_torque(tau)
 
     def reset(self, wheel_angle=None, wheel_velocity=None, sensor_noise=None):
         # Choose random wheel angle if not specified
@@ -295,6 +317,10 @@ class Simulator:
         # Choose random wheel velocity if not specified
         if wheel_velocity is None:
             wheel_velocity = 0.1 * self.rng.standard_normal()
+
+        self.q = float(wheel_angle)
+        self.v = float(wheel_velocity)
+        self.tau = 0.
         
         self.bullet_client.resetJointState(
             self.wheel_id,
@@ -316,86 +342,39 @@ class Simulator:
             video_filename=None,
             print_debug=False,
         ):
-        self.data = {
-            't': [],
-            'wheel_angle': [],
-            'wheel_velocity': [],
-            'wheel_torque': [],
-            'wheel_torque_command': [],
-            'wheel_angle_measurement': [],
-        }
-        self.variables_to_log = getattr(controller, 'variables_to_log', [])
-        for key in self.variables_to_log:
-            if key in self.data.keys():
-                raise Exception(f'Trying to log duplicate variable {key} (choose a different name)')
-            self.data[key] = []
+        self.logger = DataLogger([
+            't',
+            'wheel_angle',
+            'wheel_velocity',
+            'wheel_torque',
+            'wheel_torque_command',
+            'wheel_angle_measurement',
+        ], controller)
 
         # Always start from zero time
         self.t = 0.
         self.time_step = 0
         self.max_time_steps = 1 + int(max_time / self.dt)
-        self.start_time = time.time()
-
-        if video_filename is not None:
-            # Import imageio
-            imageio = importlib.import_module('imageio')
-
-            # Open video
-            fps = int(1 / self.dt)
-            if print_debug:
-                print(f'Creating a video with name {video_filename} and fps {fps}')
-            w = imageio.get_writer(video_filename,
-                                   format='FFMPEG',
-                                   mode='I',
-                                   fps=fps)
-
-            # Add first frame to video
-            rgba = self.pybullet_snapshot()
-            w.append_data(rgba)
+        self.pacer.reset()
 
-        while True:
-            all_done = self.step(controller)
-
-            if self.display_meshcat:
-                self.meshcat_update()
-
-            if video_filename is not None:
-                if self.time_step % 100 == 0:
-                    if print_debug:
-                        print(f' {self.time_step} / {self.max_time_steps}')
-
-                # Add frame to video
-                rgba = self.pybullet_snapshot()
-                w.append_data(rgba)
-
-            if all_done:
-                break
-
-            if (self.max_time_steps is not None) and (self.time_step == self.max_time_steps):
-                break
-
-        if video_filename is not None:
-            # Close video
-            w.close()
+        # Take time steps until done
+        run_loop(
+            self,
+            lambda: self.step(controller),
+            max_time_steps=self.max_time_steps,
+            update_display=self.meshcat_update if self.display_meshcat else None,
+            snapshot=self.pybullet_snapshot,
+            video_filename=video_filename,
+            fps=int(1 / self.dt),
+            print_every=100,
+            print_debug=print_debug,
+        )
 
+        # Save data (if necessary) and return it as numpy arrays
+        self.data = self.logger.get_lists()
         if data_filename is not None:
-            with open(data_filename, 'w') as f:
-                json.dump(self.data, f)
-
-        stop_time = time.time()
-        stop_time_step = self.time_step
-
-        elapsed_time = stop_time - self.start_time
-        elapsed_time_steps = stop_time_step
-        if elapsed_time > 0 and print_debug:
-            print(f'Simulated {elapsed_time_steps} time steps in {elapsed_time:.4f} seconds ({(elapsed_time_steps / elapsed_time):.4f} time steps per second)')
-
-        # convert lists to numpy arrays
-        data = self.data.copy()
-        for key in data.keys():
-            data[key] = np.array(data[key])
-
-        return data
+            self.logger.save(data_filename)
+        return self.logger.get_arrays()
 
     def step(self, controller):
         # Never stop early
@@ -417,34 +396,55 @@ class Simulator:
         wheel_torque = self.set_actuator_commands(wheel_torque_command)
 
         # Log data
-        self.data['t'].append(self.t)
-        self.data['wheel_angle'].append(wheel_angle)
-        self.data['wheel_velocity'].append(wheel_velocity)
-        self.data['wheel_torque'].append(wheel_torque)
-        self.data['wheel_torque_command'].append(wheel_torque_command)
-        self.data['wheel_angle_measurement'].append(wheel_angle_measurement)
-        for key in self.variables_to_log:
-            val = getattr(controller, key, np.nan)
-            if not np.isscalar(val):
-                val = val.flatten().tolist()
-            self.data[key].append(val)
+        self.logger.log(
+            self.t,
+            wheel_angle,
+            wheel_velocity,
+            wheel_torque,
+            wheel_torque_command,
+            wheel_angle_measurement,
+        )
 
         # Try to stay real-time
         if self.display_pybullet or self.display_meshcat:
-            t = self.start_time + (self.dt * (self.time_step + 1))
-            time_to_wait = t - time.time()
-            while time_to_wait > 0:
-                time.sleep(0.9 * time_to_wait)
-                time_to_wait = t - time.time()
+            self.pacer.wait(self.time_step + 1)
 
         # Take a simulation step
-        self.bullet_client.stepSimulation()
+        if self.backend == 'numpy':
+            self._numpy_step()
+        else:
+            self.bullet_client.stepSimulation()
 
         # Increment time step
         self.time_step += 1
 
         return all_done
 
+    def _numpy_step(self):
+        q, v = integrate_wheel(
+            self.q,
+            self.v,
+            self.tau,
+            self.dt,
+            self.inertia,
+            self.mass,
+            self.damping,
+            self.roll,
+            self.marker_radius,
+            self.maximum_joint_velocity,
+        )
+        self.q = float(q)
+        self.v = float(v)
+
+    def _sync_pybullet(self):
+        if self.backend == 'numpy':
+            self.bullet_client.resetJointState(
+                self.wheel_id,
+                self.joint_map['base_to_wheel'],
+                self.q,
+                self.v,
+            )
+
     def camera(self):
         if self.display_pybullet:
             self.bullet_client.resetDebugVisualizerCamera(self.camera_distance, -90 + self.camera_yaw, -self.camera_pitch, self.camera_target)
@@ -471,6 +471,7 @@ class Simulator:
         self.camera()
 
     def pybullet_snapshot(self):
+        self._sync_pybullet()
         pos = self.camera_target
         yaw = -90 + self.camera_yaw
         aspect = self.width / self.height
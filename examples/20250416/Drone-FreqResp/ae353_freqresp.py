@@ -0,0 +1,228 @@
+import numpy as np
+from scipy import linalg
+from scipy import optimize
+from collections import OrderedDict
+
+
+# LRUCache and get_key are copied from examples/20250305/ae353_lqr.py (each
+# example directory is self-contained) - change both copies together
+
+
+class LRUCache:
+    """
+    Remembers the values of at most maxsize keys, forgetting the one that was
+    least recently used when full.
+    """
+
+    def __init__(self, maxsize=64):
+        self.maxsize = maxsize
+        self.values = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, compute):
+        """
+        returns the value of key, calling compute() to find it if necessary
+        """
+        if key in self.values:
+            self.hits += 1
+            self.values.move_to_end(key)
+            return self.values[key]
+        self.misses += 1
+        value = compute()
+        self.values[key] = value
+        if len(self.values) > self.maxsize:
+            self.values.popitem(last=False)
+        return value
+
+    def clear(self):
+        self.values.clear()
+        self.hits = 0
+        self.misses = 0
+
+
+def get_key(*args):
+    """
+    returns a hashable key for any number of scalars and numpy arrays
+    """
+    key = []
+    for arg in args:
+        arg = np.asarray(arg, dtype=float)
+        key.append((arg.shape, arg.tobytes()))
+    return tuple(key)
+
+
+def get_closed_loop_model(A, B, C, K, L, input_index=1, output_index=None):
+    """
+    returns Am, Bm, Cm for the closed-loop system (controller and observer)
+    with input xdes[input_index] (the only element of xdes that varies) and
+    output x[output_index] (by default, the same element of x)
+    """
+    if output_index is None:
+        output_index = input_index
+
+    n = A.shape[0]
+    e_i = np.zeros((n, 1))
+    e_i[input_index] = 1.
+    e_o = np.zeros((n, 1))
+    e_o[output_index] = 1.
+
+    Am = np.block([[A    , -B @ K           ],
+                   [L @ C, A - B @ K - L @ C]])
+
+    Bm = np.block([[B @ K @ e_i],
+                   [B @ K @ e_i]])
+
+    Cm = np.block([[e_o.T, np.zeros((1, n))]])
+
+    return Am, Bm, Cm
+
+
+class FrequencyResponse:
+    """
+    Evaluates the transfer function
+
+        H(s) = Cm (s - Am)^{-1} Bm
+
+    of a system with one input and one output at any number of frequencies.
+
+    If possible, Am is diagonalized once, here, as Am = V diag(lambda) V^{-1}
+    - then
+
+        H(s) = sum_k (Cm V)_k (V^{-1} Bm)_k / (s - lambda_k)
+
+    at all frequencies at once, with no matrix inverse.
+
+    If Am is (close to) not diagonalizable - which is common for closed-loop
+    systems with a controller and an observer - Am is reduced once, here, to
+    upper Hessenberg form Am = U Ah U^T (U orthogonal) - then
+
+        H(s) = (Cm U) (s - Ah)^{-1} (U^T Bm)
+
+    where each solve with (s - Ah) takes only one pass of elimination below
+    the diagonal, done at all frequencies at once.
+    """
+
+    def __init__(self, Am, Bm, Cm, maximum_condition_number=1e8):
+        if (Bm.shape[1] != 1) or (Cm.shape[0] != 1):
+            raise Exception('system must have exactly one input and one output')
+        self.Am = Am
+        self.Bm = Bm
+        self.Cm = Cm
+
+        # Diagonalize Am (if possible)
+        self.eigenvalues, V = linalg.eig(Am)
+        self.is_diagonalizable = np.linalg.cond(V) < maximum_condition_number
+        if self.is_diagonalizable:
+            self.residues = (Cm @ V).flatten() * linalg.solve(V, Bm).flatten()
+        else:
+            Ah, U = linalg.hessenberg(Am, calc_q=True)
+            self.Ah = Ah
+            self.Bh = (U.T @ Bm).flatten()
+            self.Ch = (Cm @ U).flatten()
+
+    def evaluate(self, s):
+        """
+        returns H(s) at each complex number in s (a 1d array)
+        """
+        s = np.atleast_1d(np.asarray(s, dtype=complex))
+        if self.is_diagonalizable:
+            return (1. / (s[:, np.newaxis] - self.eigenvalues)) @ self.residues
+
+        # Solve at no more than 1000 frequencies at a time to limit memory use
+        H = np.empty(len(s), dtype=complex)
+        for i in range(0, len(s), 1000):
+            H[i:(i + 1000)] = self._evaluate_hessenberg(s[i:(i + 1000)])
+        return H
+
+    def _evaluate_hessenberg(self, s):
+        n = self.Ah.shape[0]
+        rows = np.arange(len(s))
+
+        # Create M = (s - Ah) and b = U^T Bm at each frequency
+        M = np.empty((len(s), n, n), dtype=complex)
+        M[:] = -self.Ah
+        M[:, np.arange(n), np.arange(n)] += s[:, np.newaxis]
+        b = np.empty((len(s), n), dtype=complex)
+        b[:] = self.Bh
+
+        # Eliminate the one element below the diagonal in each column (with
+        # partial pivoting, which can only swap rows k and k + 1)
+        for k in range(n - 1):
+            swap = np.absolute(M[:, k + 1, k]) > np.absolute(M[:, k, k])
+            if swap.any():
+                M_k = M[swap, k, k:]
+                M[swap, k, k:] = M[swap, k + 1, k:]
+                M[swap, k + 1, k:] = M_k
+                b_k = b[swap, k]
+                b[swap, k] = b[swap, k + 1]
+                b[swap, k + 1] = b_k
+            f = M[:, k + 1, k] / M[:, k, k]
+            M[:, k + 1, k:] -= f[:, np.newaxis] * M[:, k, k:]
+            b[:, k + 1] -= f * b[:, k]
+
+        # Back-substitute
+        x = np.empty((len(s), n), dtype=complex)
+        for k in range(n - 1, -1, -1):
+            x[:, k] = (b[:, k] - np.einsum('ij,ij->i', M[:, k, k + 1:], x[:, k + 1:])) / M[rows, k, k]
+
+        return x @ self.Ch
+
+    def get_bode(self, omega):
+        """
+        returns a dictionary with H(j omega), its magnitude (absolute and in dB),
+        and its angle (in radians and in degrees) at each frequency in omega
+        """
+        omega = np.asarray(omega, dtype=float)
+        H = self.evaluate(1j * omega)
+        mag = np.absolute(H)
+        ang = np.angle(H)
+        return {
+            'omega': omega,
+            'H': H,
+            'mag': mag,
+            'mag_in_dB': 20. * np.log10(mag),
+            'ang': ang,
+            'ang_in_deg': np.rad2deg(ang),
+        }
+
+    def get_bandwidth(self, omega_min=1e-2, omega_max=1e2, number_of_frequencies=1000):
+        """
+        returns the lowest frequency (radians / second) at which the magnitude
+        of H(j omega) falls to 3 dB below its magnitude at omega_min - returns
+        np.inf if this does not happen at any frequency less than omega_max
+        """
+
+        # Find the first frequency on a grid at which magnitude is too low
+        omega = np.logspace(np.log10(omega_min), np.log10(omega_max), number_of_frequencies)
+        mag = np.absolute(self.evaluate(1j * omega))
+        mag_at_bandwidth = 10**(-3 / 20) * mag[0]
+        i = np.flatnonzero(mag < mag_at_bandwidth)
+        if len(i) == 0:
+            return np.inf
+        i = i[0]
+
+        # Find exactly where magnitude falls between this frequency and the last
+        return optimize.brentq(
+            lambda w: np.absolute(self.evaluate(1j * w)[0]) - mag_at_bandwidth,
+            omega[i - 1],
+            omega[i],
+        )
+
+
+# Cache of frequency responses (one for each controller)
+frequency_response_cache = LRUCache(maxsize=64)
+
+
+def get_frequency_response(A, B, C, K, L, input_index=1, output_index=None):
+    """
+    returns a FrequencyResponse for the closed-loop system (see
+    get_closed_loop_model), reusing one that was found before for the
+    same (A, B, C, K, L) if possible
+    """
+    def compute():
+        return FrequencyResponse(*get_closed_loop_model(A, B, C, K, L, input_index, output_index))
+    return frequency_response_cache.get(
+        get_key(A, B, C, K, L, input_index, input_index if output_index is None else output_index),
+        compute,
+    )
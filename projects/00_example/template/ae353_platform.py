@@ -2,10 +2,10 @@ import numpy as np
 import pybullet
 from pybullet_utils import bullet_client
 import time
-import json
-import importlib
 import meshcat
 from pathlib import Path
+from ae353_actuators import TorqueActuators
+from ae353_core import DataLogger, RealTimePacer, run_loop, wxyz_from_xyzw, convert_color
 
 class Simulator:
     def __init__(
@@ -18,6 +18,7 @@ class Simulator:
                 roll=0.,
                 damping=0.,
                 tau_max=5.,
+                backend='pybullet',
             ):
 
         # Random number generator
@@ -30,11 +31,20 @@ class Simulator:
         # Time step
         self.dt = 0.01
 
+        # Real-time pacing (used only when displaying)
+        self.pacer = RealTimePacer(self.dt, sleep_fraction=0.9)
+
         # Other parameters
         self.roll = roll
         self.damping = damping
         self.tau_max = tau_max
 
+        # Physics backend ('pybullet' or 'numpy' - the latter integrates the
+        # same equations of motion directly and uses pybullet only to draw)
+        if backend not in ['pybullet', 'numpy']:
+            raise Exception(f'Invalid backend "{backend}" (choose "pybullet" or "numpy")')
+        self.backend = backend
+
         # Connect to and configure pybullet
         self.display_pybullet = display_pybullet
         self.display_meshcat = display
@@ -106,10 +116,42 @@ class Simulator:
             forces=np.zeros(self.num_joints)
         )
 
+        # Prepare to apply torque commands to each joint (only the wheel is
+        # actuated)
+        self.actuators = TorqueActuators(
+            self.bullet_client,
+            self.robot_id,
+            self.joint_ids,
+            ['wheel_torque_command'],
+            self.tau_max,
+        )
+
         # Eliminate linear and angular damping (a poor model of drag)
         self.bullet_client.changeDynamics(self.robot_id, -1, linearDamping=0., angularDamping=0.)
         for joint_id in range(self.bullet_client.getNumJoints(self.robot_id)):
             self.bullet_client.changeDynamics(self.robot_id, joint_id, linearDamping=0., angularDamping=0.)
+
+        # Initialize model and state of numpy backend
+        # - mass properties and geometry (from URDF)
+        J_p = self.bullet_client.getDynamicsInfo(self.robot_id, self.link_map['platform_link'])[2][2]
+        J_w = self.bullet_client.getDynamicsInfo(self.robot_id, self.link_map['wheel_link'])[2][2]
+        self.m_w = self.bullet_client.getDynamicsInfo(self.robot_id, self.link_map['wheel_link'])[0]
+        self.l = np.linalg.norm(self.bullet_client.getJointInfo(
+            self.robot_id,
+            self.joint_map['platform_to_connector_fixed'],
+        )[14][0:2])
+        # - inverse of the (constant) mass matrix
+        self.M_inv = np.linalg.inv(np.array([
+            [J_p + self.m_w * self.l**2 + J_w, J_w],
+            [J_w, J_w],
+        ])).tolist()
+        # - platform and wheel angles and velocities
+        self.q = [0., 0.]
+        self.v = [0., 0.]
+        # - applied torques
+        self.tau = [0., 0.]
+        # - joint speed limit (pybullet default)
+        self.maximum_joint_velocity = 100.
         
         # Initialize meshcat if necessary
         if self.display_meshcat:
@@ -133,6 +175,8 @@ class Simulator:
         self.reset()
 
     def get_sensor_measurements(self):
+        if self.backend == 'numpy':
+            return self.q[0], self.v[0], self.q[1], self.v[1]
         joint_states = self.bullet_client.getJointStates(self.robot_id, self.joint_ids)
         platform_angle = joint_states[0][0]
         platform_velocity = joint_states[0][1]
@@ -141,22 +185,16 @@ class Simulator:
         return platform_angle, platform_velocity, wheel_angle, wheel_velocity
 
     def set_actuator_commands(self, wheel_torque_command):
-        assert(np.isscalar(wheel_torque_command))
-        wheel_torque = np.clip(wheel_torque_command, -self.tau_max, self.tau_max)
+        wheel_torque, = self.actuators.clip((wheel_torque_command,))
         self.set_joint_torque(np.array([0., wheel_torque]))
         return wheel_torque
     
     def set_joint_torque(self, tau):
         assert(tau.shape[0] == self.num_joints)
-        zero_gains = tau.shape[0] * (0.,)
-        self.bullet_client.setJointMotorControlArray(
-            self.robot_id,
-            self.joint_ids,
-            self.bullet_client.TORQUE_CONTROL,
-            forces=tau,
-            positionGains=zero_gains,
-            velocityGains=zero_gains
-        )
+        if self.backend == 'numpy':
+            self.tau = tau.tolist()
+            return
+        self.actuators.set_joint_torque(tau)
     
     def reset(
             self,
@@ -165,6 +203,10 @@ class Simulator:
             wheel_angle=0.,
             wheel_velocity=0.,
         ):
+
+        self.q = [float(platform_angle), float(wheel_angle)]
+        self.v = [float(platform_velocity), float(wheel_velocity)]
+        self.tau = [0., 0.]
         
         self.bullet_client.resetJointState(
             self.robot_id,
@@ -191,85 +233,40 @@ class Simulator:
             print_debug=False
         ):
 
-        self.data = {
-            't': [],
-            'platform_angle': [],
-            'platform_velocity': [],
-            'wheel_angle': [],
-            'wheel_velocity': [],
-            'wheel_torque': [],
-            'wheel_torque_command': [],
-        }
-        self.variables_to_log = getattr(controller, 'variables_to_log', [])
-        for key in self.variables_to_log:
-            if key in self.data.keys():
-                raise Exception(f'Trying to log duplicate variable {key} (choose a different name)')
-            self.data[key] = []
+        self.logger = DataLogger([
+            't',
+            'platform_angle',
+            'platform_velocity',
+            'wheel_angle',
+            'wheel_velocity',
+            'wheel_torque',
+            'wheel_torque_command',
+        ], controller)
 
         # Always start from zero time
         self.t = 0.
         self.time_step = 0
         self.max_time_steps = 1 + int(max_time / self.dt)
-        self.start_time = time.time()
-
-        if video_filename is not None:
-            # Import imageio
-            imageio = importlib.import_module('imageio')
-
-            # Open video
-            fps = int(1 / self.dt)
-            print(f'Creating a video with name {video_filename} and fps {fps}')
-            w = imageio.get_writer(video_filename,
-                                   format='FFMPEG',
-                                   mode='I',
-                                   fps=fps)
-
-            # Add first frame to video
-            rgba = self.snapshot()
-            w.append_data(rgba)
-
-        while True:
-            all_done = self.step(controller)
-
-            if self.display_meshcat:
-                self.meshcat_update()
-
-            if video_filename is not None:
-                if self.time_step % 100 == 0:
-                    print(f' {self.time_step} / {self.max_time_steps}')
-
-                # Add frame to video
-                rgba = self.snapshot()
-                w.append_data(rgba)
+        self.pacer.reset()
 
-            if all_done:
-                break
-
-            if (self.max_time_steps is not None) and (self.time_step == self.max_time_steps):
-                break
-
-        if video_filename is not None:
-            # Close video
-            w.close()
+        # Take time steps until done
+        run_loop(
+            self,
+            lambda: self.step(controller),
+            max_time_steps=self.max_time_steps,
+            update_display=self.meshcat_update if self.display_meshcat else None,
+            snapshot=self.snapshot,
+            video_filename=video_filename,
+            fps=int(1 / self.dt),
+            print_every=100,
+            print_debug=print_debug,
+        )
 
+        # Save data (if necessary) and return it as numpy arrays
+        self.data = self.logger.get_lists()
         if data_filename is not None:
-            with open(data_filename, 'w') as f:
-                json.dump(self.data, f)
-
-        stop_time = time.time()
-        stop_time_step = self.time_step
-
-        elapsed_time = stop_time - self.start_time
-        elapsed_time_steps = stop_time_step
-        if (elapsed_time > 0) and print_debug:
-            print(f'Simulated {elapsed_time_steps} time steps in {elapsed_time:.4f} seconds ({(elapsed_time_steps / elapsed_time):.4f} time steps per second)')
-
-        # convert lists to numpy arrays
-        data = self.data.copy()
-        for key in data.keys():
-            data[key] = np.array(data[key])
-
-        return data
+            self.logger.save(data_filename)
+        return self.logger.get_arrays()
 
     def step(self, controller):
         # Never stop early
@@ -296,36 +293,67 @@ class Simulator:
         )
 
         # Log data
-        self.data['t'].append(self.t)
-        self.data['platform_angle'].append(platform_angle)
-        self.data['platform_velocity'].append(platform_velocity)
-        self.data['wheel_angle'].append(wheel_angle)
-        self.data['wheel_velocity'].append(wheel_velocity)
-        self.data['wheel_torque'].append(wheel_torque)
-        self.data['wheel_torque_command'].append(wheel_torque_command)
-        for key in self.variables_to_log:
-            val = getattr(controller, key, np.nan)
-            if not np.isscalar(val):
-                val = val.flatten().tolist()
-            self.data[key].append(val)
+        self.logger.log(
+            self.t,
+            platform_angle,
+            platform_velocity,
+            wheel_angle,
+            wheel_velocity,
+            wheel_torque,
+            wheel_torque_command,
+        )
 
         # Try to stay real-time
         if self.display_pybullet or self.display_meshcat:
-            t = self.start_time + (self.dt * (self.time_step + 1))
-            time_to_wait = t - time.time()
-            while time_to_wait > 0:
-                time.sleep(0.9 * time_to_wait)
-                time_to_wait = t - time.time()
+            self.pacer.wait(self.time_step + 1)
 
         # Take a simulation step
-        self.bullet_client.stepSimulation()
+        if self.backend == 'numpy':
+            self._numpy_step()
+        else:
+            self.bullet_client.stepSimulation()
 
         # Increment time step
         self.time_step += 1
 
         return all_done
 
+    def _numpy_step(self):
+        # Generalized forces on the platform and wheel joints, where - like
+        # pybullet - damping is evaluated once at the start of each time step
+        # and held constant over all substeps
+        f_1 = self.tau[0] - self.damping * self.v[0]
+        f_2 = self.tau[1] - self.damping * self.v[1]
+        f_gravity = - self.m_w * 9.81 * self.l * np.sin(self.roll)
+        ((M_11, M_12), (M_21, M_22)) = self.M_inv
+
+        # Semi-implicit Euler with the same fixed time step and number of
+        # substeps as pybullet
+        q_1, q_2 = self.q
+        v_1, v_2 = self.v
+        v_max = self.maximum_joint_velocity
+        h = self.dt / 4
+        for i in range(4):
+            g_1 = f_1 + f_gravity * np.sin(q_1)
+            v_1 = min(max(v_1 + h * (M_11 * g_1 + M_12 * f_2), -v_max), v_max)
+            v_2 = min(max(v_2 + h * (M_21 * g_1 + M_22 * f_2), -v_max), v_max)
+            q_1 += h * v_1
+            q_2 += h * v_2
+        self.q = [q_1, q_2]
+        self.v = [v_1, v_2]
+
+    def _sync_pybullet(self):
+        if self.backend == 'numpy':
+            for i, joint_name in enumerate(self.joint_names):
+                self.bullet_client.resetJointState(
+                    self.robot_id,
+                    self.joint_map[joint_name],
+                    self.q[i],
+                    self.v[i],
+                )
+
     def pybullet_snapshot(self):
+        self._sync_pybullet()
         pos = self.camera_target
         yaw = -90 + self.camera_yaw
         aspect = self.width / self.height
@@ -414,17 +442,10 @@ class Simulator:
         self.update_display()
     
     def _wxyz_from_xyzw(self, xyzw):
-        return np.roll(xyzw, 1)
+        return wxyz_from_xyzw(xyzw)
 
     def _convert_color(self, rgba):
-        color = int(rgba[0] * 255) * 256**2 + int(rgba[1] * 255) * 256 + int(rgba[2] * 255)
-        opacity = rgba[3]
-        transparent = opacity != 1.0
-        return {
-            'color': color,
-            'opacity': opacity,
-            'transparent': transparent,
-        }
+        return convert_color(rgba)
 
     def meshcat_init(self):
         # Create a visualizer
@@ -492,6 +513,9 @@ class Simulator:
         #        this function more efficient.
         #
 
+        # Copy state from numpy backend (if necessary)
+        self._sync_pybullet()
+
         # Set pose of plane base
         pos_and_ori = self.bullet_client.getBasePositionAndOrientation(self.plane_id)
         pos = pos_and_ori[0]
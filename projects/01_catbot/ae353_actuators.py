@@ -0,0 +1,124 @@
+import numpy as np
+import time
+
+
+class TorqueActuators:
+    """
+    Applies torque commands to the joints of one body in pybullet.
+
+    Everything that does not change from one time step to the next (joint
+    indices, zero gains, torque limits, and the pybullet function that sets
+    joint torques) is found once, here, instead of at every time step.
+    """
+
+    def __init__(
+            self,
+            bullet_client,
+            body_id,
+            joint_ids,
+            command_names,
+            maximum_commands=np.inf,
+        ):
+        self.bullet_client = bullet_client
+        self.body_id = body_id
+        self.joint_ids = [int(joint_id) for joint_id in joint_ids]
+        self.num_joints = len(self.joint_ids)
+        self.zero_gains = self.num_joints * (0.,)
+        self.command_names = list(command_names)
+        self.num_commands = len(self.command_names)
+        self.maximum_commands = np.broadcast_to(
+            np.array(maximum_commands, dtype=float),
+            (self.num_commands,),
+        ).copy()
+        self.minimum_commands = -self.maximum_commands
+        self.torque_control = bullet_client.TORQUE_CONTROL
+        self._set_joint_motor_control_array = bullet_client.setJointMotorControlArray
+
+    def clip(self, commands):
+        """
+        returns a 1d numpy array with commands (a list or tuple of scalars,
+        one for each command name) clipped to the maximum commands - raises
+        an exception if any command is not a scalar
+        """
+
+        # Check all commands at once, and only look at each one (to say which
+        # is not a scalar) if something is wrong
+        try:
+            commands_array = np.array(commands, dtype=float)
+        except (TypeError, ValueError):
+            commands_array = None
+        if (commands_array is None) or (commands_array.shape != (self.num_commands,)):
+            if len(commands) != self.num_commands:
+                raise Exception(f'there must be exactly {self.num_commands} commands ' + \
+                                f'({", ".join(self.command_names)})')
+            for name, command in zip(self.command_names, commands):
+                if (not np.isscalar(command)) or isinstance(command, (str, bytes)):
+                    raise Exception(f'{name} must be a scalar')
+            raise Exception('every command must be a number')
+
+        return np.clip(commands_array, self.minimum_commands, self.maximum_commands, out=commands_array)
+
+    def set_joint_torque(self, tau):
+        """
+        applies the torques in tau (a 1d numpy array) to the joints
+        """
+        if len(tau) != self.num_joints:
+            raise Exception('tau must be the same length as the number of joints')
+        self._set_joint_motor_control_array(
+            self.body_id,
+            self.joint_ids,
+            self.torque_control,
+            forces=tau.tolist(),
+            positionGains=self.zero_gains,
+            velocityGains=self.zero_gains,
+        )
+
+
+def benchmark_actuators(actuators, number_of_calls=10000):
+    """
+    Measures the time (in seconds) per call to check, clip, and apply one set
+    of torque commands, both with actuators and with the scalar-by-scalar path
+    it replaces. Commands go to the real body, so use a simulator that is not
+    used for anything else.
+    If there are fewer commands than joints, commands go to the last joints.
+    """
+
+    bullet_client = actuators.bullet_client
+    commands = tuple(float(c) for c in np.linspace(-10., 10., actuators.num_commands))
+    tau = np.zeros(actuators.num_joints)
+
+    # Scalar-by-scalar path (check and clip each command, then rebuild the
+    # gains and look up the pybullet function at every call)
+    start_time = time.perf_counter()
+    for i in range(number_of_calls):
+        for name, command in zip(actuators.command_names, commands):
+            if not np.isscalar(command):
+                raise Exception(f'{name} must be a scalar')
+        clipped_commands = [
+            np.clip(command, -maximum_command, maximum_command)
+            for command, maximum_command in zip(commands, actuators.maximum_commands)
+        ]
+        tau[-actuators.num_commands:] = clipped_commands
+        zero_gains = tau.shape[0] * (0.,)
+        bullet_client.setJointMotorControlArray(
+            actuators.body_id,
+            np.array(actuators.joint_ids),
+            bullet_client.TORQUE_CONTROL,
+            forces=tau,
+            positionGains=zero_gains,
+            velocityGains=zero_gains,
+        )
+    scalar_time = (time.perf_counter() - start_time) / number_of_calls
+
+    # Vectorized path
+    start_time = time.perf_counter()
+    for i in range(number_of_calls):
+        tau[-actuators.num_commands:] = actuators.clip(commands)
+        actuators.set_joint_torque(tau)
+    vectorized_time = (time.perf_counter() - start_time) / number_of_calls
+
+    return {
+        'scalar': scalar_time,
+        'vectorized': vectorized_time,
+        'speedup': scalar_time / vectorized_time,
+    }
@@ -1,13 +1,106 @@
 import numpy as np
 import pybullet
 from pybullet_utils import bullet_client
-import time
-import json
-import importlib
 import meshcat
 from pathlib import Path
 import umsgpack
 from playsound import playsound
+import multiprocessing
+from ae353_actuators import TorqueActuators
+from ae353_core import DataLogger, RealTimePacer, run_loop, wxyz_from_xyzw, convert_color
+
+
+def _score_init(controller, simulator_kwargs, maximum_time, termination_events):
+    global _score_controller, _score_simulator_kwargs, _score_maximum_time, _score_termination_events
+    _score_controller = controller
+    _score_simulator_kwargs = simulator_kwargs
+    _score_maximum_time = maximum_time
+    _score_termination_events = termination_events
+
+def _score_run(seed):
+    controller = _score_controller
+    simulator = Simulator(display=False, seed=seed, **_score_simulator_kwargs)
+
+    # Run until every cat has been saved or not (unless told otherwise)
+    maximum_time = _score_maximum_time
+    if maximum_time is None:
+        maximum_time = simulator.all_cats_resolved_time_step * simulator.dt
+    if hasattr(controller, 'reset'):
+        controller.reset()
+    simulator.reset()
+    simulator.run(
+        controller,
+        maximum_time=maximum_time,
+        termination_events=_score_termination_events,
+    )
+
+    return {
+        'seed': seed,
+        'number_of_cats_saved': simulator.number_of_cats_saved,
+        'cats_saved': simulator.cats_saved.copy(),
+        'termination_event': simulator.termination_event,
+        'time': simulator.t,
+    }
+
+def score_controller(
+        controller,
+        seeds,
+        maximum_time=None,
+        termination_events=('tipped_over', 'out_of_bounds', 'all_cats_resolved'),
+        number_of_processes=None,
+        **simulator_kwargs,
+    ):
+    """
+    Runs controller once for each seed in seeds (i.e., for the sequence of cat
+    launches given by Simulator(seed=seed)) and counts the cats saved. Other
+    keyword arguments (e.g., number_of_cats) are passed to the Simulator.
+
+    A cat counts as saved if it is on the robot at the time the next cat is
+    launched (or, for the last cat, one launch interval after it was launched).
+    By default, each run stops as soon as the robot tips over or leaves the
+    platform, or all cats have been either saved or not. Cats that were never
+    resolved count as not saved.
+
+    Seeds are split across number_of_processes worker processes (default, one
+    per CPU). The controller is copied to each worker - if it cannot be copied
+    (e.g., on Windows or MacOS when defined in a notebook), use
+    number_of_processes=1 to run everything in this process instead.
+
+    Returns a dictionary with the results for each seed and summary statistics
+    over all seeds.
+    """
+
+    seeds = list(seeds)
+    termination_events = list(termination_events)
+    if number_of_processes is None:
+        number_of_processes = multiprocessing.cpu_count()
+    number_of_processes = max(1, min(number_of_processes, len(seeds)))
+
+    # Run with all seeds
+    if number_of_processes == 1:
+        _score_init(controller, simulator_kwargs, maximum_time, termination_events)
+        results = [_score_run(seed) for seed in seeds]
+    else:
+        with multiprocessing.Pool(
+                    number_of_processes,
+                    initializer=_score_init,
+                    initargs=(controller, simulator_kwargs, maximum_time, termination_events),
+                ) as pool:
+            results = pool.map(_score_run, seeds)
+
+    # Summary statistics over all seeds
+    number_of_cats_saved = np.array([r['number_of_cats_saved'] for r in results])
+    number_of_cats = np.array([len(r['cats_saved']) for r in results])
+    return {
+        'results': results,
+        'seeds': seeds,
+        'number_of_cats_saved': number_of_cats_saved,
+        'total_number_of_cats_saved': int(np.sum(number_of_cats_saved)),
+        'mean_number_of_cats_saved': float(np.mean(number_of_cats_saved)),
+        'min_number_of_cats_saved': int(np.min(number_of_cats_saved)),
+        'max_number_of_cats_saved': int(np.max(number_of_cats_saved)),
+        'fraction_of_cats_saved': float(np.sum(number_of_cats_saved) / np.sum(number_of_cats)),
+    }
 
 
 class Simulator:
@@ -28,6 +121,9 @@ class Simulator:
 
         # Time step
         self.dt = dt
+
+        # Real-time pacing (used only when displaying)
+        self.pacer = RealTimePacer(self.dt, sleep_fraction=0.75)
         
         # Other parameters
         # - Passed
@@ -48,6 +144,9 @@ class Simulator:
         self.platform_length = 10.
         self.platform_width = 2.
         self.joint_damping = 0.
+        self.maximum_pitch_angle = 1.            # <-- chassis rests on the platform at about 1.29 rad
+        self.termination_events = []
+        self.termination_event = None
         
         # Connect to and configure pybullet
         self.display_meshcat = display
@@ -138,6 +237,14 @@ class Simulator:
             forces=np.zeros(self.num_joints),
         )
 
+        # Prepare to apply torque commands to each robot joint
+        self.actuators = TorqueActuators(
+            self.bullet_client,
+            self.robot_id,
+            self.joint_ids,
+            ['left_wheel_torque', 'right_wheel_torque'],
+        )
+
         # Initialize meshcat if necessary
         if self.display_meshcat:
             self.meshcat_init()
@@ -165,46 +272,49 @@ class Simulator:
         """
 
         # Position of each wheel (center)
-        link_states = self.bullet_client.getLinkStates(self.robot_id, self.joint_ids)
-        pl = np.array(link_states[0][0])
-        pr = np.array(link_states[1][0])
-        pc = 0.5 * (pr + pl)
-        wheel_position = pc[0]
+        (pl, *_), (pr, *_) = self.bullet_client.getLinkStates(self.robot_id, self.joint_ids)
+        wheel_position = 0.5 * (pr[0] + pl[0])
 
         # Velocity of each wheel
-        joint_states = self.bullet_client.getJointStates(self.robot_id, self.joint_ids)
-        q = np.zeros([self.num_joints])
-        v = np.zeros_like(q)
-        for i in range(self.num_joints):
-            q[i] = joint_states[i][0]
-            v[i] = joint_states[i][1]
-        vl = v[0] * self.wheel_radius
-        vr = v[1] * self.wheel_radius
+        (ql, wl, *_), (qr, wr, *_) = self.bullet_client.getJointStates(self.robot_id, self.joint_ids)
+        vl = wl * self.wheel_radius
+        vr = wr * self.wheel_radius
         wheel_velocity = (vr + vl) / 2.0
 
         # Lateral error (positive when located too far to left)
-        lateral_error = pc[1]
+        lateral_error = 0.5 * (pr[1] + pl[1])
 
         # Heading error (positive when turned too far to left)
         # - vector from left wheel to right wheel
-        a_in0 = pr - pl
+        a_x = pr[0] - pl[0]
+        a_y = pr[1] - pl[1]
+        a_z = pr[2] - pl[2]
         # - heading error
-        heading_error = np.arctan2(a_in0[0], -a_in0[1])
+        heading_error = np.arctan2(a_x, -a_y)
 
         # Turning rate (positive when turning to the left)
-        turning_rate = (vr - vl) / np.linalg.norm(pr - pl)
-
-        # Position, orientation, and angular velocity of chassis
-        pos, ori = self.bullet_client.getBasePositionAndOrientation(self.robot_id)
-        vel = self.bullet_client.getBaseVelocity(self.robot_id)
-        rpy = self.bullet_client.getEulerFromQuaternion(ori)
-        R_body_in_world = np.reshape(np.array(self.bullet_client.getMatrixFromQuaternion(ori)), (3, 3))
-        w_in_world = np.reshape(np.array(vel[1]), (3, 1))
-        w_in_body = R_body_in_world.T @ w_in_world
-        
-        # Pitch angle and pitch rate
-        pitch_angle = rpy[1]
-        pitch_rate = w_in_body[1, 0]
+        turning_rate = (vr - vl) / np.sqrt(a_x**2 + a_y**2 + a_z**2)
+
+        # Orientation and angular velocity of chassis
+        pos, (x, y, z, w) = self.bullet_client.getBasePositionAndOrientation(self.robot_id)
+        linvel, (w_x, w_y, w_z) = self.bullet_client.getBaseVelocity(self.robot_id)
+
+        # Pitch angle (computed from the quaternion in the same way as by
+        # pybullet.getEulerFromQuaternion)
+        sin_pitch = -2. * (x * z - w * y)
+        if sin_pitch <= -0.99999:
+            pitch_angle = -0.5 * np.pi
+        elif sin_pitch >= 0.99999:
+            pitch_angle = 0.5 * np.pi
+        else:
+            pitch_angle = np.arcsin(sin_pitch)
+
+        # Pitch rate (angular velocity about the y axis of the chassis, i.e.,
+        # the dot product of angular velocity in the world frame with the
+        # second column of the rotation matrix from body to world frame)
+        pitch_rate = 2. * (x * y - w * z) * w_x + \
+                     (1. - 2. * (x**2 + z**2)) * w_y + \
+                     2. * (y * z + w * x) * w_z
 
         return (
             wheel_position,
@@ -221,27 +331,10 @@ class Simulator:
                 right_wheel_torque_command,
                 left_wheel_torque_command,
             ):
-        
-        if not np.isscalar(right_wheel_torque_command):
-            raise Exception('right_wheel_torque must be a scalar')
-        
-        if not np.isscalar(left_wheel_torque_command):
-            raise Exception('left_wheel_torque must be a scalar')
-
-        self.set_joint_torque(np.array([left_wheel_torque_command, right_wheel_torque_command]))
+        self.set_joint_torque(self.actuators.clip((left_wheel_torque_command, right_wheel_torque_command)))
     
     def set_joint_torque(self, tau):
-        if tau.shape[0] != self.num_joints:
-            raise Exception('tau must be the same length as the number of joints')
-        zero_gains = tau.shape[0] * (0.,)
-        self.bullet_client.setJointMotorControlArray(
-            self.robot_id,
-            self.joint_ids,
-            self.bullet_client.TORQUE_CONTROL,
-            forces=tau,
-            positionGains=zero_gains,
-            velocityGains=zero_gains,
-        )
+        self.actuators.set_joint_torque(tau)
 
     def reset(
             self,
@@ -291,53 +384,90 @@ class Simulator:
         self._update_display()
     
     def get_number_of_cats_saved(self):
-        x_safe = 0.5 * self.platform_length
-        y_safe = 0.5 * self.platform_width
-        z_safe = self.wheel_radius + \
-                 self.wheel_to_body + \
-                 0.5 * self.body_height  # <-- requires the robot to be upright
         number_of_cats_saved = 0
         for cat_id in self.cat_id:
             pos, ori = self.bullet_client.getBasePositionAndOrientation(cat_id)
-            is_x_safe = np.abs(pos[0]) < x_safe
-            is_y_safe = np.abs(pos[1]) < y_safe
-            is_z_safe = pos[2] > z_safe
-            if is_x_safe and is_y_safe and is_z_safe:
+            if self._is_cat_saved(pos):
                 number_of_cats_saved += 1
         return number_of_cats_saved
+
+    def _is_cat_saved(self, pos):
+        x_safe = 0.5 * self.platform_length
+        y_safe = 0.5 * self.platform_width
+        z_safe = self.wheel_radius + \
+                 self.wheel_to_body + \
+                 0.5 * self.body_height  # <-- requires the robot to be upright
+        is_x_safe = np.abs(pos[0]) < x_safe
+        is_y_safe = np.abs(pos[1]) < y_safe
+        is_z_safe = pos[2] > z_safe
+        return is_x_safe and is_y_safe and is_z_safe
+
+    def _update_cats_saved(self):
+        # Decide if each cat has been saved as soon as it has had a full launch
+        # interval to land (i.e., just before the next cat is launched)
+        while self.number_of_cats_resolved < len(self.launches):
+            i = self.number_of_cats_resolved
+            if self.time_step < self.launches[i]['time_step'] + self.launch_interval:
+                break
+            pos, ori = self.bullet_client.getBasePositionAndOrientation(self.cat_id[i])
+            self.cats_saved[i] = self._is_cat_saved(pos)
+            self.number_of_cats_saved += int(self.cats_saved[i])
+            self.number_of_cats_resolved += 1
     
-    def get_launch(self, i, x, max_iters=50, min_sep=0.3):
-        for j in range(max_iters):
-            x1 = self.rng.uniform(-self.maximum_cat_target, self.maximum_cat_target)
-            xdot0 = 5. if x1 < 0. else -5.
-            z1 = 1.2
-            zdot1 = -5.
-            x0, z0, zdot0 = self.get_flying_cat(self.launch_duration, x1, z1, xdot0, zdot1)
-            is_collision = False
-            for x_i in x:
-                if np.abs(x_i - x0) < min_sep:
-                    is_collision = True
-            if not is_collision:
-                return {
-                    'time_step': self.launch_start + (i * self.launch_interval),
-                    'x1': x1,
-                    'z1': z1,
-                    'x0': x0,
-                    'z0': z0,
-                    'xdot0': xdot0,
-                    'zdot0': zdot0,
-                }
-        return None
-
-    def get_launches(self):
-        x = []
+    def get_launches(self, max_iters=50, min_sep=0.3):
+        """
+        Chooses a target for each cat so that no two cats are launched from
+        within min_sep of each other. Each cat gets max_iters candidate targets
+        and takes the first one that is far enough from the launch positions
+        of all cats before it. Returns None if some cat has no such candidate.
+
+        All candidates are drawn at once (max_iters for every cat, whether or
+        not they are needed), so the same seed gives different launches than
+        it did when candidates were drawn one at a time.
+        """
+
+        # Draw candidate targets for all cats at once (one row per cat)
+        x1 = self.rng.uniform(
+            -self.maximum_cat_target,
+            self.maximum_cat_target,
+            size=(self.number_of_cats, max_iters),
+        )
+        xdot0 = np.where(x1 < 0., 5., -5.)
+        z1 = 1.2
+        zdot1 = -5.
+        x0, z0, zdot0 = self.get_flying_cat(self.launch_duration, x1, z1, xdot0, zdot1)
+
+        # Find, for every candidate, the range of candidates (in order of
+        # launch position) that are launched from within min_sep of it
+        x0_all = x0.flatten()
+        order = np.argsort(x0_all)
+        x0_sorted = x0_all[order]
+        lo = np.searchsorted(x0_sorted, x0_all - min_sep, side='right')
+        hi = np.searchsorted(x0_sorted, x0_all + min_sep, side='left')
+        rank = np.empty_like(order)
+        rank[order] = np.arange(len(order))
+        rank = np.reshape(rank, x0.shape)
+
+        # Choose the first candidate of each cat that is not too close to the
+        # candidates already chosen for cats before it
+        is_allowed = np.ones(len(order), dtype=bool)
         launches = []
         for i in range(self.number_of_cats):
-            launch = self.get_launch(i, x)
-            if launch is None:
+            is_allowed_i = is_allowed[rank[i]]
+            if not is_allowed_i.any():
                 return None
-            launches.append(launch)
-            x.append(launch['x0'])
+            j = np.argmax(is_allowed_i)
+            k = (i * max_iters) + j
+            is_allowed[lo[k]:hi[k]] = False
+            launches.append({
+                'time_step': self.launch_start + (i * self.launch_interval),
+                'x1': float(x1[i, j]),
+                'z1': z1,
+                'x0': float(x0[i, j]),
+                'z0': float(z0),
+                'xdot0': float(xdot0[i, j]),
+                'zdot0': float(zdot0),
+            })
         return launches
 
     def reset_launches(self, max_iters=20):
@@ -359,6 +489,16 @@ class Simulator:
             )
         self.current_cat = -1
         self.cat_target = 0.
+        self.cats_saved = np.zeros(len(self.launches), dtype=bool)
+        self.number_of_cats_saved = 0
+        self.number_of_cats_resolved = 0
+
+        # Every cat has either been saved or not by the time the last one has
+        # had a full launch interval to land
+        if len(self.launches) > 0:
+            self.all_cats_resolved_time_step = self.launches[-1]['time_step'] + self.launch_interval
+        else:
+            self.all_cats_resolved_time_step = 0
 
     def launch_cat(self, which_cat):
         launch = self.launches[which_cat]
@@ -379,6 +519,22 @@ class Simulator:
         if self.sound:
             playsound(self.meow, block=False)
 
+    def _is_tipped_over(self, pitch_angle):
+        return np.abs(pitch_angle) > self.maximum_pitch_angle
+
+    def _is_out_of_bounds(self, wheel_position, lateral_error):
+        # The robot has driven off the end or the side of the platform
+        if np.abs(wheel_position) > 0.5 * self.platform_length:
+            return True
+
+        if np.abs(lateral_error) > 0.5 * self.platform_width:
+            return True
+
+        return False
+
+    def _are_all_cats_resolved(self):
+        return self.time_step >= self.all_cats_resolved_time_step
+
     def get_flying_cat(self, t1, x1, z1, xdot0, zdot1, g=9.81):
         zdot0 = zdot1 + g * t1
         z0 = z1 - (zdot0 * t1 - 0.5 * g * t1**2)
@@ -392,107 +548,73 @@ class Simulator:
             data_filename=None,
             video_filename=None,
             print_debug=False,
+            termination_events=None,
         ):
 
-        self.data = {
-            't': [],
-            'wheel_position': [],
-            'wheel_velocity': [],
-            'pitch_angle': [],
-            'pitch_rate': [],
-            'cat_target': [],
-            'wheel_torque': [],
-            'wheel_torque_command': [],
-        }
+        # Events that stop the simulation early (if they occur)
+        if termination_events is None:
+            termination_events = []
+        for event in termination_events:
+            if event not in ['tipped_over', 'out_of_bounds', 'all_cats_resolved']:
+                raise Exception(f'Invalid termination event "{event}" ' + \
+                                 '(choose "tipped_over", "out_of_bounds", or "all_cats_resolved")')
+        self.termination_events = list(termination_events)
+        self.termination_event = None
+
+        keys = [
+            't',
+            'wheel_position',
+            'wheel_velocity',
+            'pitch_angle',
+            'pitch_rate',
+            'cat_target',
+            'wheel_torque',
+            'wheel_torque_command',
+            'number_of_cats_saved',
+        ]
         if self.log_hidden_variables:
-            self.data['lateral_error'] = []
-            self.data['heading_error'] = []
-            self.data['turning_rate'] = []
-        self.variables_to_log = getattr(controller, 'variables_to_log', [])
-        for key in self.variables_to_log:
-            if key in self.data.keys():
-                raise Exception(f'Trying to log duplicate variable {key} (choose a different name)')
-            self.data[key] = []
+            keys += [
+                'lateral_error',
+                'heading_error',
+                'turning_rate',
+            ]
+        self.logger = DataLogger(keys, controller)
 
         # Always start from zero time
         self.t = 0.
         self.time_step = 0
         self.maximum_time_steps = 1 + int(maximum_time / self.dt)
-        self.start_time = time.time()
-
-        if video_filename is not None:
-            # Import imageio
-            imageio = importlib.import_module('imageio')
-
-            # Open video
-            fps = 25
-            if int(1 / self.dt) % 25 != 0:
-                raise Exception(f'To create a video, 1 / dt ({1 / self.dt}) must be an ' + \
-                                 'integer that is divisible by fps ({fps})')
-            if print_debug:
-                print(f'Creating a video with name {video_filename} and fps {fps}')
-            w = imageio.get_writer(video_filename,
-                                   format='FFMPEG',
-                                   mode='I',
-                                   fps=fps)
-
-            # Add first frame to video
-            rgba = self.snapshot()
-            w.append_data(rgba)
-
-        while True:
-            all_done = self.step(controller)
-
-            if self.display_meshcat:
-                self.meshcat_update()
-
-            if video_filename is not None:
-                if self.time_step % 100 == 0:
-                    if print_debug:
-                        print(f' {self.time_step} / {self.maximum_time_steps}')
-
-                # Add frame to video
-                if self.time_step % int(1 / (self.dt * fps)) == 0:
-                    rgba = self.snapshot()
-                    w.append_data(rgba)
-
-            if all_done:
-                break
+        self.pacer.reset()
 
-            if (self.maximum_time_steps is not None) and (self.time_step == self.maximum_time_steps):
-                break
-
-        if video_filename is not None:
-            # Close video
-            w.close()
+        # Take time steps until done
+        run_loop(
+            self,
+            lambda: self.step(controller),
+            max_time_steps=self.maximum_time_steps,
+            update_display=self._update_display,
+            snapshot=self.snapshot,
+            video_filename=video_filename,
+            fps=25,
+            print_every=100,
+            print_debug=print_debug,
+        )
 
+        # Save data (if necessary) and return it as numpy arrays
+        self.data = self.logger.get_lists()
         if data_filename is not None:
-            with open(data_filename, 'w') as f:
-                json.dump(self.data, f)
-
-        stop_time = time.time()
-        stop_time_step = self.time_step
-
-        elapsed_time = stop_time - self.start_time
-        elapsed_time_steps = stop_time_step
-        if (elapsed_time > 0) and print_debug:
-            print(f'Simulated {elapsed_time_steps} time steps in {elapsed_time:.4f} seconds ' + \
-                  f'({(elapsed_time_steps / elapsed_time):.4f} time steps per second)')
-
-        # convert lists to numpy arrays
-        data = self.data.copy()
-        for key in data.keys():
-            data[key] = np.array(data[key])
-
-        return data
+            self.logger.save(data_filename)
+        return self.logger.get_arrays()
 
     def step(self, controller):
-        # Never stop early
+        # Stop early only if a termination event occurs
         all_done = False
 
         # Get the current time
         self.t = self.time_step * self.dt
 
+        # Count cats saved so far
+        self._update_cats_saved()
+
         # Launch cat (if necessary)
         if self.current_cat + 1 < self.number_of_cats:
             launch = self.launches[self.current_cat + 1]
@@ -510,6 +632,39 @@ class Simulator:
             heading_error,
             turning_rate,
         ) = self.get_sensor_measurements()
+
+        # Check termination events (cheap, because they only use the sensor
+        # measurements we already have and the current time step) and, if any
+        # has occurred, log the final state and stop before applying any
+        # commands - so nothing is left queued in pybullet for the next run
+        for event in self.termination_events:
+            if event == 'tipped_over':
+                all_done = self._is_tipped_over(pitch_angle)
+            elif event == 'out_of_bounds':
+                all_done = self._is_out_of_bounds(wheel_position, lateral_error)
+            elif event == 'all_cats_resolved':
+                all_done = self._are_all_cats_resolved()
+            if all_done:
+                self.termination_event = event
+                values = (
+                    self.t,
+                    wheel_position,
+                    wheel_velocity,
+                    pitch_angle,
+                    pitch_rate,
+                    self.cat_target,
+                    np.nan,
+                    np.nan,
+                    self.number_of_cats_saved,
+                )
+                if self.log_hidden_variables:
+                    values += (
+                        lateral_error,
+                        heading_error,
+                        turning_rate,
+                    )
+                self.logger.log(*values)
+                return all_done
         
         # Get wheel torque command (run the controller)
         wheel_torque_command = controller.run(
@@ -539,31 +694,28 @@ class Simulator:
         )
 
         # Log data
-        self.data['t'].append(self.t)
-        self.data['wheel_position'].append(wheel_position)
-        self.data['wheel_velocity'].append(wheel_velocity)
-        self.data['pitch_angle'].append(pitch_angle)
-        self.data['pitch_rate'].append(pitch_rate)
-        self.data['cat_target'].append(self.cat_target)
-        self.data['wheel_torque'].append(wheel_torque)
-        self.data['wheel_torque_command'].append(wheel_torque_command)
+        values = (
+            self.t,
+            wheel_position,
+            wheel_velocity,
+            pitch_angle,
+            pitch_rate,
+            self.cat_target,
+            wheel_torque,
+            wheel_torque_command,
+            self.number_of_cats_saved,
+        )
         if self.log_hidden_variables:
-            self.data['lateral_error'].append(lateral_error)
-            self.data['heading_error'].append(heading_error)
-            self.data['turning_rate'].append(turning_rate)
-        for key in self.variables_to_log:
-            val = getattr(controller, key, np.nan)
-            if not np.isscalar(val):
-                val = val.flatten().tolist()
-            self.data[key].append(val)
+            values += (
+                lateral_error,
+                heading_error,
+                turning_rate,
+            )
+        self.logger.log(*values)
 
         # Try to stay real-time
         if self.display_meshcat:
-            t = self.start_time + (self.dt * (self.time_step + 1))
-            time_to_wait = t - time.time()
-            while time_to_wait > 0:
-                time.sleep(0.75 * time_to_wait)
-                time_to_wait = t - time.time()
+            self.pacer.wait(self.time_step + 1)
 
         # Take a simulation step
         self.bullet_client.stepSimulation()
@@ -638,17 +790,10 @@ class Simulator:
         self._update_display()
     
     def _wxyz_from_xyzw(self, xyzw):
-        return np.roll(xyzw, 1)
+        return wxyz_from_xyzw(xyzw)
 
     def _convert_color(self, rgba):
-        color = int(rgba[0] * 255) * 256**2 + int(rgba[1] * 255) * 256 + int(rgba[2] * 255)
-        opacity = rgba[3]
-        transparent = opacity != 1.0
-        return {
-            'color': color,
-            'opacity': opacity,
-            'transparent': transparent,
-        }
+        return convert_color(rgba)
 
     def meshcat_lights(self):
         # As of 1/21/2025, meshcat-python has a bug that does not allow
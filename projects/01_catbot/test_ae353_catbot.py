@@ -0,0 +1,44 @@
+from pathlib import Path
+import numpy as np
+import pytest
+
+import ae353_catbot
+
+
+class ConstantController:
+    def __init__(self, wheel_torque):
+        self.wheel_torque = wheel_torque
+
+    def reset(self):
+        pass
+
+    def run(self, t, *state):
+        return self.wheel_torque
+
+
+@pytest.fixture(autouse=True)
+def run_in_project_directory(monkeypatch):
+    # The simulator loads its URDF files relative to the current directory
+    monkeypatch.chdir(Path(__file__).resolve().parent)
+
+
+def test_rerun_after_termination_is_same_as_new_simulator():
+    # Leave a run that ends with a termination event in the reused simulator
+    simulator = ae353_catbot.Simulator(display=False, seed=0)
+    simulator.reset()
+    simulator.run(ConstantController(5.), maximum_time=3., termination_events=['tipped_over'])
+    assert simulator.termination_event == 'tipped_over'
+
+    # Every reset draws new cat launches, so start both simulators from the
+    # same random number generator state before the run that is compared
+    simulator.rng = np.random.default_rng(1)
+    simulator.reset()
+    data_reused = simulator.run(ConstantController(0.), maximum_time=1.)
+
+    simulator = ae353_catbot.Simulator(display=False, seed=0)
+    simulator.rng = np.random.default_rng(1)
+    simulator.reset()
+    data_new = simulator.run(ConstantController(0.), maximum_time=1.)
+
+    for key in data_new:
+        assert np.array_equal(data_reused[key], data_new[key], equal_nan=True)
@@ -1,13 +1,14 @@
 import numpy as np
 import pybullet
 from pybullet_utils import bullet_client
-import time
-import json
-import importlib
+import functools
+import multiprocessing
+from statistics import NormalDist
 import meshcat
 from pathlib import Path
 import umsgpack
 from playsound import playsound
+from ae353_core import DataLogger, RealTimePacer, run_loop, wxyz_from_xyzw, convert_color
 
 colors = {
     'industrial-blue': [0.11372549019607843, 0.34509803921568627, 0.6549019607843137, 1.0],
@@ -15,6 +16,399 @@ colors = {
     'heritage-orange': [0.96078431, 0.50980392, 0.11764706, 1.0],
 }
 
+def get_aerodynamic_forces_vectorized(u, v, w, p, q, r, delta_r, delta_l, params):
+    """
+    Computes the aerodynamic forces and torques (in the body frame) for many
+    states at once. This is the only copy of the aerodynamic model - the
+    simulator calls it with one state at each time step.
+
+    Each of u, v, w, p, q, r, delta_r, delta_l may be a scalar or an array,
+    and all are broadcast against each other. Parameters are unpacked only
+    once for the whole batch. Complex inputs are allowed (e.g., for use with
+    the complex-step method) - all branches depend only on real parts.
+
+    Returns f_x, f_y, f_z, m_x, m_y, m_z, each an array of the broadcast shape.
+    """
+
+    # Define parameters
+    rho, S, c, b, g = params['rho'], params['S'], params['c'], params['b'], params['g']
+    C_L_0, C_L_alpha, C_L_q, C_L_delta_e = params['C_L_0'], params['C_L_alpha'], params['C_L_q'], params['C_L_delta_e']
+    C_D_0, C_D_alpha, C_D_q, C_D_delta_e = params['C_D_0'], params['C_D_alpha'], params['C_D_q'], params['C_D_delta_e']
+    C_m_0, C_m_alpha, C_m_q, C_m_delta_e = params['C_m_0'], params['C_m_alpha'], params['C_m_q'], params['C_m_delta_e']
+    C_Y_0, C_Y_beta, C_Y_p, C_Y_r, C_Y_delta_a = params['C_Y_0'], params['C_Y_beta'], params['C_Y_p'], params['C_Y_r'], params['C_Y_delta_a']
+    C_l_0, C_l_beta, C_l_p, C_l_r, C_l_delta_a = params['C_l_0'], params['C_l_beta'], params['C_l_p'], params['C_l_r'], params['C_l_delta_a']
+    C_n_0, C_n_beta, C_n_p, C_n_r, C_n_delta_a = params['C_n_0'], params['C_n_beta'], params['C_n_p'], params['C_n_r'], params['C_n_delta_a']
+    e, alpha_0, C_D_p, M = params['e'], params['alpha_0'], params['C_D_p'], params['M']
+    k, k_e = params['k'], params['k_e']
+
+    # Broadcast all inputs to a common shape and a common (real or complex) type
+    inputs = [np.asarray(x) for x in (u, v, w, p, q, r, delta_r, delta_l)]
+    dtype = np.result_type(float, *inputs)
+    u, v, w, p, q, r, delta_r, delta_l = [x.astype(dtype) for x in np.broadcast_arrays(*inputs)]
+
+    # Get airspeed, angle of attack, and angle of sideslip
+    # - there are no aerodynamic forces when airspeed is (close to) zero, so
+    #   replace airspeed with one in this case to avoid dividing by zero
+    # - "close to zero" is the same as np.isclose(x, 0.), which is much slower
+    #   than the comparison for small batches (e.g., one state per time step)
+    V_a = np.sqrt(u**2 + v**2 + w**2)
+    is_still = np.abs(V_a.real) <= 1e-8
+    has_still = np.any(is_still)
+    if has_still:
+        V_a = np.where(is_still, 1., V_a)
+    # - attempting to make alpha have the correct sign when u is (close to) zero
+    is_vertical = np.abs(u.real) <= 1e-8
+    if np.any(is_vertical):
+        alpha = np.where(
+            is_vertical,
+            np.sign(u.real * w.real) * (np.pi / 2),
+            np.atan(w / np.where(is_vertical, 1., u)),
+        )
+    else:
+        alpha = np.atan(w / u)
+    beta = np.asin(v / V_a)
+
+    # Convert from right and left elevons to elevator and aileron
+    delta_e = (delta_r + delta_l) / 2
+    delta_a = (-delta_r + delta_l) / 2
+
+    # Longitudinal aerodynamics
+    sigma = (1. + np.exp(-M * (alpha - alpha_0)) + np.exp(M * (alpha + alpha_0))) / ((1. + np.exp(-M * (alpha - alpha_0))) * (1. + np.exp(M * (alpha + alpha_0))))
+    C_L = (1 - sigma) * (C_L_0 + C_L_alpha * alpha) + sigma * (2. * np.sign(alpha.real) * (np.sin(alpha)**2) * np.cos(alpha))
+    F_lift = rho * V_a**2 * S * (C_L + C_L_q * (c / (2 * V_a)) * q + C_L_delta_e * delta_e) / 2
+    F_drag = rho * V_a**2 * S * ((C_D_0 + k * C_L**2) + C_D_q * (c / (2 * V_a)) * q + k_e * (C_L_delta_e * delta_e)**2) / 2
+    f_x = np.cos(alpha) * (-F_drag) - np.sin(alpha) * (-F_lift)
+    f_z = np.sin(alpha) * (-F_drag) + np.cos(alpha) * (-F_lift)
+    m_y = rho * V_a**2 * S * c * (C_m_0 + C_m_alpha * alpha + C_m_q * (c / (2 * V_a)) * q + C_m_delta_e * delta_e) / 2
+
+    # Lateral aerodynamics (no rudder)
+    f_y = rho * V_a**2 * S * (C_Y_0 + C_Y_beta * beta + C_Y_p * (b / (2 * V_a)) * p + C_Y_r * (b / (2 * V_a)) * r + C_Y_delta_a * delta_a) / 2
+    m_x = rho * V_a**2 * S * b * (C_l_0 + C_l_beta * beta + C_l_p * (b / (2 * V_a)) * p + C_l_r * (b / (2 * V_a)) * r + C_l_delta_a * delta_a) / 2
+    m_z = rho * V_a**2 * S * b * (C_n_0 + C_n_beta * beta + C_n_p * (b / (2 * V_a)) * p + C_n_r * (b / (2 * V_a)) * r + C_n_delta_a * delta_a) / 2
+
+    if has_still:
+        return tuple(np.where(is_still, 0., f) for f in (f_x, f_y, f_z, m_x, m_y, m_z))
+    return f_x, f_y, f_z, m_x, m_y, m_z
+
+def get_state_derivative_vectorized(x, u, params):
+    """
+    Computes the time derivative of the state for many states and inputs at
+    once, using the same aerodynamic model as the simulator.
+
+    x is an array of shape (..., 12) with states
+
+        p_x, p_y, p_z, psi, theta, phi, v_x, v_y, v_z, w_x, w_y, w_z
+
+    and u is an array of shape (..., 2) with inputs delta_r, delta_l (+z is
+    down, as in the simulator). Returns an array of shape (..., 12). Complex
+    inputs are allowed (e.g., for use with the complex-step method).
+    """
+
+    # Define parameters
+    m, g = params['m'], params['g']
+    J_x, J_y, J_z, J_xz = params['J_x'], params['J_y'], params['J_z'], params['J_xz']
+
+    # Get components of state and input
+    x = np.asarray(x)
+    u = np.asarray(u)
+    p_x, p_y, p_z, psi, theta, phi, v_x, v_y, v_z, w_x, w_y, w_z = np.moveaxis(x, -1, 0)
+    delta_r, delta_l = np.moveaxis(u, -1, 0)
+
+    # Get aerodynamic forces and torques
+    f_x, f_y, f_z, tau_x, tau_y, tau_z = get_aerodynamic_forces_vectorized(
+        v_x, v_y, v_z, w_x, w_y, w_z, delta_r, delta_l, params,
+    )
+
+    # Rotation matrix R = Rz(psi) Ry(theta) Rx(phi) that describes the
+    # orientation of the body frame in the world frame
+    c_psi, s_psi = np.cos(psi), np.sin(psi)
+    c_theta, s_theta = np.cos(theta), np.sin(theta)
+    c_phi, s_phi = np.cos(phi), np.sin(phi)
+    R_11, R_12, R_13 = c_psi * c_theta, c_psi * s_theta * s_phi - s_psi * c_phi, c_psi * s_theta * c_phi + s_psi * s_phi
+    R_21, R_22, R_23 = s_psi * c_theta, s_psi * s_theta * s_phi + c_psi * c_phi, s_psi * s_theta * c_phi - c_psi * s_phi
+    R_31, R_32, R_33 = -s_theta, c_theta * s_phi, c_theta * c_phi
+
+    # Rate of change of position (in the world frame)
+    p_x_dot = R_11 * v_x + R_12 * v_y + R_13 * v_z
+    p_y_dot = R_21 * v_x + R_22 * v_y + R_23 * v_z
+    p_z_dot = R_31 * v_x + R_32 * v_y + R_33 * v_z
+
+    # Rate of change of yaw, pitch, and roll angles
+    psi_dot = (s_phi * w_y + c_phi * w_z) / c_theta
+    theta_dot = c_phi * w_y - s_phi * w_z
+    phi_dot = w_x + (s_phi * w_y + c_phi * w_z) * (s_theta / c_theta)
+
+    # Rate of change of linear velocity (in the body frame) - gravity is
+    # m * g along +z in the world frame, so its body components are the
+    # third row of R times m * g
+    v_x_dot = (R_31 * g) + (f_x / m) - (w_y * v_z - w_z * v_y)
+    v_y_dot = (R_32 * g) + (f_y / m) - (w_z * v_x - w_x * v_z)
+    v_z_dot = (R_33 * g) + (f_z / m) - (w_x * v_y - w_y * v_x)
+
+    # Rate of change of angular velocity (in the body frame)
+    h_x = J_x * w_x - J_xz * w_z
+    h_y = J_y * w_y
+    h_z = J_z * w_z - J_xz * w_x
+    n_x = tau_x - (w_y * h_z - w_z * h_y)
+    n_y = tau_y - (w_z * h_x - w_x * h_z)
+    n_z = tau_z - (w_x * h_y - w_y * h_x)
+    det = J_x * J_z - J_xz**2
+    w_x_dot = (J_z * n_x + J_xz * n_z) / det
+    w_y_dot = n_y / J_y
+    w_z_dot = (J_xz * n_x + J_x * n_z) / det
+
+    return np.stack(np.broadcast_arrays(
+        p_x_dot, p_y_dot, p_z_dot,
+        psi_dot, theta_dot, phi_dot,
+        v_x_dot, v_y_dot, v_z_dot,
+        w_x_dot, w_y_dot, w_z_dot,
+    ), axis=-1)
+
+def get_jacobians(x, u, params, method='complex-step', h=None):
+    """
+    Computes A = df/dx and B = df/du for many states and inputs at once.
+
+    x has shape (n, 12) and u has shape (n, 2). The method is either
+    'complex-step' (default, exact to machine precision) or 'central'
+    (central finite differences). All perturbed states for all n points are
+    evaluated in a single call to get_state_derivative_vectorized.
+
+    Returns A with shape (n, 12, 12) and B with shape (n, 12, 2).
+    """
+
+    x = np.atleast_2d(np.asarray(x, dtype=float))
+    u = np.atleast_2d(np.asarray(u, dtype=float))
+    n, n_x = x.shape
+    n_u = u.shape[1]
+
+    # Stack state and input, then perturb each of their components in turn
+    z = np.concatenate([x, u], axis=1)
+    E = np.eye(n_x + n_u)
+    if method == 'complex-step':
+        if h is None:
+            h = 1e-20
+        z_pert = z[:, None, :] + 1j * h * E[None, :, :]
+        f = get_state_derivative_vectorized(z_pert[..., :n_x], z_pert[..., n_x:], params)
+        J = f.imag / h
+    elif method == 'central':
+        if h is None:
+            h = 1e-6
+        z_pert = np.concatenate([
+            z[:, None, :] + h * E[None, :, :],
+            z[:, None, :] - h * E[None, :, :],
+        ], axis=1)
+        f = get_state_derivative_vectorized(z_pert[..., :n_x], z_pert[..., n_x:], params)
+        J = (f[:, :(n_x + n_u)] - f[:, (n_x + n_u):]) / (2 * h)
+    else:
+        raise Exception(f'method must be "complex-step" or "central" (you chose "{method}")')
+
+    # J[k, j, i] is the derivative of f_i with respect to z_j at point k
+    J = np.swapaxes(J, 1, 2)
+    return J[:, :, :n_x], J[:, :, n_x:]
+
+def get_trim(airspeeds, params, tol=1e-10, max_iters=50):
+    """
+    Finds wings-level, steady gliding flight (with zero sideslip, zero angular
+    velocity, and equal elevon deflections) at each given airspeed.
+
+    Newton's method is applied to all airspeeds at once, solving for angle of
+    attack, pitch angle, and elevon deflection so that v_x, v_z, and w_y are
+    constant. Returns states x with shape (n, 12) and inputs u with shape
+    (n, 2), with zero position and yaw angle. Elevon limits are not enforced,
+    so check u against maximum_elevon_deflection. There is no trim below the
+    stall speed (a little over 5 m/s with the default parameters).
+    """
+
+    V_a = np.atleast_1d(np.asarray(airspeeds, dtype=float))
+    n = len(V_a)
+
+    def get_trim_point(z):
+        alpha, theta, delta_e = np.moveaxis(z, -1, 0)
+        V = np.reshape(V_a, (n,) + (1,) * (alpha.ndim - 1))
+        zero = np.zeros_like(alpha)
+        x = np.stack([
+            zero, zero, zero,
+            zero, theta, zero,
+            V * np.cos(alpha), zero, V * np.sin(alpha),
+            zero, zero, zero,
+        ], axis=-1)
+        u = np.stack([delta_e, delta_e], axis=-1)
+        return x, u
+
+    def get_residual(z):
+        x, u = get_trim_point(z)
+        return get_state_derivative_vectorized(x, u, params)[..., [6, 8, 10]]
+
+    # Initial guess of angle of attack, pitch angle, and elevon deflection,
+    # from the linear (no stall) model with zero pitching moment and with
+    # lift equal to weight
+    C_L_required = 2 * params['m'] * params['g'] / (params['rho'] * V_a**2 * params['S'])
+    d_0 = -params['C_m_0'] / params['C_m_delta_e']
+    d_1 = -params['C_m_alpha'] / params['C_m_delta_e']
+    alpha = (C_L_required - params['C_L_0'] - params['C_L_delta_e'] * d_0) / (params['C_L_alpha'] + params['C_L_delta_e'] * d_1)
+    alpha = np.clip(alpha, -0.4, 0.4)
+    gamma = -(params['C_D_0'] + params['k'] * C_L_required**2) / C_L_required
+    z = np.stack([alpha, alpha + gamma, d_0 + d_1 * alpha], axis=-1)
+
+    # Apply Newton's method (with backtracking) to all airspeeds at once
+    h = 1e-20
+    step_sizes = 0.5**np.arange(8)
+    for i in range(max_iters):
+        r = get_residual(z)
+        r_norm = np.linalg.norm(r, axis=-1)
+        if np.max(r_norm) < tol:
+            break
+        J = np.swapaxes(get_residual(z[:, None, :] + 1j * h * np.eye(3)[None, :, :]).imag / h, 1, 2)
+        dz = np.linalg.solve(J, -r[..., None])[..., 0]
+        # - try every step size at once, then take the largest one that decreases
+        #   the residual (or the smallest one if none do)
+        z_trial = z[:, None, :] + step_sizes[None, :, None] * dz[:, None, :]
+        is_better = np.linalg.norm(get_residual(z_trial), axis=-1) < r_norm[:, None]
+        j = np.where(is_better.any(axis=1), np.argmax(is_better, axis=1), len(step_sizes) - 1)
+        z = z_trial[np.arange(n), j]
+    else:
+        # - check the residual at the last step, not the one before it
+        r_norm = np.linalg.norm(get_residual(z), axis=-1)
+        failed = V_a[r_norm >= tol]
+        if len(failed) > 0:
+            raise Exception(f'Could not find trim at airspeeds {failed.tolist()} after {max_iters} iterations.')
+
+    return get_trim_point(z)
+
+@functools.lru_cache(maxsize=64)
+def _get_linear_models_cached(params_items, airspeeds, method):
+    # params are passed as a sorted tuple of (name, value) pairs so they can
+    # be part of the cache key
+    params = dict(params_items)
+    airspeeds = np.array(airspeeds, dtype=float)
+    x, u = get_trim(airspeeds, params)
+    A, B = get_jacobians(x, u, params, method=method)
+    return {
+        'airspeed': airspeeds,
+        'x': x,
+        'u': u,
+        'A': A,
+        'B': B,
+    }
+
+def get_linear_models(airspeeds, params, method='complex-step'):
+    """
+    Finds trim (see get_trim) and linearizes the equations of motion about it
+    (see get_jacobians) at each given airspeed, all in one batched call.
+
+    Results for the 64 most recent combinations of params, airspeeds, and
+    method are cached, so repeated calls (e.g., after re-running a notebook
+    cell) are free until params change. Each parameter must be a scalar (a
+    float, or a numpy scalar or array with one element).
+
+    Returns a dictionary with keys 'airspeed' (n,), 'x' (n, 12), 'u' (n, 2),
+    'A' (n, 12, 12), and 'B' (n, 12, 2).
+    """
+
+    airspeeds = np.atleast_1d(np.asarray(airspeeds, dtype=float))
+    models = _get_linear_models_cached(
+        tuple(sorted((name, float(value)) for name, value in params.items())),
+        tuple(airspeeds.tolist()),
+        method,
+    )
+
+    # Return copies so the cached results cannot be changed by the caller
+    return {k: v.copy() for k, v in models.items()}
+
+def _monte_carlo_init(controller, simulator_kwargs):
+    # Create one simulator (without display) per worker process and reuse it for every run
+    global _monte_carlo_simulator, _monte_carlo_controller
+    _monte_carlo_simulator = Simulator(display=False, **simulator_kwargs)
+    _monte_carlo_controller = controller
+
+def _monte_carlo_run(seed, maximum_time):
+    simulator = _monte_carlo_simulator
+    controller = _monte_carlo_controller
+
+    # Sample initial conditions exactly as Simulator(seed=seed).reset() would
+    simulator.rng = np.random.default_rng(seed)
+    simulator.reset()
+    if hasattr(controller, 'reset'):
+        controller.reset()
+
+    # Run until the aircraft lands, crashes, or runs out of time
+    data = simulator.run(
+        controller,
+        maximum_time=maximum_time,
+        termination_events=['landed', 'crashed'],
+    )
+    return simulator.has_landed(), data['t'][-1]
+
+def run_monte_carlo(
+        controller,
+        number_of_runs=100,
+        seeds=None,
+        maximum_time=60.,
+        number_of_processes=None,
+        confidence=0.95,
+        simulator_kwargs=None,
+    ):
+    """
+    Estimates the probability that controller lands the aircraft, with
+    initial conditions sampled (as in Simulator.reset) from the bounds given
+    by simulator_kwargs (e.g., maximum_initial_psi). Each run stops as soon as
+    the aircraft has landed or crashed.
+
+    Run i uses seeds[i] (default 0, 1, ..., number_of_runs - 1), so a failed
+    run can be reproduced with Simulator(seed=seeds[i]) followed by reset().
+    Runs are split across number_of_processes worker processes (default, one
+    per CPU). The controller is copied to each worker - if it cannot be
+    copied (e.g., on Windows or MacOS when defined in a notebook), use
+    number_of_processes=1 to do all runs in this process instead.
+
+    Returns a dictionary with the success rate, its (Wilson score) confidence
+    interval, and the seeds of all runs that failed.
+    """
+
+    if seeds is None:
+        seeds = np.arange(number_of_runs)
+    seeds = [int(seed) for seed in seeds]
+    if simulator_kwargs is None:
+        simulator_kwargs = {}
+    if number_of_processes is None:
+        number_of_processes = multiprocessing.cpu_count()
+    number_of_processes = max(1, min(number_of_processes, len(seeds)))
+
+    # Do all runs
+    args = [(seed, maximum_time) for seed in seeds]
+    if number_of_processes == 1:
+        _monte_carlo_init(controller, simulator_kwargs)
+        results = [_monte_carlo_run(*a) for a in args]
+    else:
+        with multiprocessing.Pool(
+                    number_of_processes,
+                    initializer=_monte_carlo_init,
+                    initargs=(controller, simulator_kwargs),
+                ) as pool:
+            results = pool.starmap(_monte_carlo_run, args)
+    landed = np.array([r[0] for r in results], dtype=bool)
+    final_time = np.array([r[1] for r in results])
+
+    # Success rate and confidence interval
+    n = len(seeds)
+    n_landed = int(np.sum(landed))
+    p = n_landed / n
+    z = NormalDist().inv_cdf(0.5 + confidence / 2)
+    center = (p + z**2 / (2 * n)) / (1 + z**2 / n)
+    half_width = (z / (1 + z**2 / n)) * np.sqrt(p * (1 - p) / n + z**2 / (4 * n**2))
+
+    return {
+        'number_of_runs': n,
+        'number_of_successes': n_landed,
+        'success_rate': p,
+        'confidence': confidence,
+        'confidence_interval': (float(max(0., center - half_width)), float(min(1., center + half_width))),
+        'seeds': np.array(seeds),
+        'landed': landed,
+        'final_time': final_time,
+        'failing_seeds': [seed for seed, is_landed in zip(seeds, landed) if not is_landed],
+    }
+
 class Simulator:
     def __init__(
                 self,
@@ -33,6 +427,9 @@ class Simulator:
         # Time step
         self.dt = dt
 
+        # Real-time pacing (used only when displaying)
+        self.pacer = RealTimePacer(self.dt, sleep_fraction=0.75)
+
         # Elevon angles
         self.delta_r = 0.
         self.delta_l = 0.
@@ -48,6 +445,9 @@ class Simulator:
         self.landing_height = 1.
         self.landing_position = [150. + (2 * self.landing_length / 5), 0., 15. + (self.landing_height / 2)]
         self.maximum_elevon_deflection = 0.5        # <-- slightly less than 30 degrees
+        self.out_of_bounds_distance = 50.
+        self.termination_events = []
+        self.termination_event = None
         self.params = {
             'g': 9.81,               # Gravity (m/s²)
             'm': 1.56,               # Mass of the UAV (kg)
@@ -198,7 +598,9 @@ class Simulator:
 
     def has_landed(self):
         p_x, p_y, p_z, psi, theta, phi, v_x, v_y, v_z, w_x, w_y, w_z = self.get_sensor_measurements()
+        return self._has_landed(p_x, p_y, p_z, v_x, v_y, v_z)
 
+    def _has_landed(self, p_x, p_y, p_z, v_x, v_y, v_z):
         # Airspeed must be near zero
         V_a = np.sqrt(v_x**2 + v_y**2 + v_z**2)
 
@@ -224,6 +626,31 @@ class Simulator:
             return False
         
         return True
+
+    def has_crashed(self):
+        p_x, p_y, p_z, psi, theta, phi, v_x, v_y, v_z, w_x, w_y, w_z = self.get_sensor_measurements()
+        return self._has_crashed(p_z)
+
+    def _has_crashed(self, p_z):
+        # The aircraft can no longer land once it is below the landing platform
+        return p_z > self.landing_position[2]
+
+    def is_out_of_bounds(self):
+        p_x, p_y, p_z, psi, theta, phi, v_x, v_y, v_z, w_x, w_y, w_z = self.get_sensor_measurements()
+        return self._is_out_of_bounds(p_x, p_y)
+
+    def _is_out_of_bounds(self, p_x, p_y):
+        # The aircraft has strayed too far behind, beside, or beyond the landing platform
+        if p_x < -self.out_of_bounds_distance:
+            return True
+
+        if p_x > self.landing_position[0] + (self.landing_length / 2) + self.out_of_bounds_distance:
+            return True
+
+        if np.abs(p_y) > self.out_of_bounds_distance:
+            return True
+
+        return False
     
     def set_actuator_commands(
                 self,
@@ -322,153 +749,82 @@ class Simulator:
             data_filename=None,
             video_filename=None,
             print_debug=False,
+            termination_events=None,
         ):
 
-        self.data = {
-            't': [],
-            'p_x': [],
-            'p_y': [],
-            'p_z': [],
-            'psi': [],
-            'theta': [],
-            'phi': [],
-            'v_x': [],
-            'v_y': [],
-            'v_z': [],
-            'w_x': [],
-            'w_y': [],
-            'w_z': [],
-            'delta_r_command': [],
-            'delta_l_command': [],
-            'delta_r': [],
-            'delta_l': [],
-            'f_x': [],
-            'f_y': [],
-            'f_z': [],
-            'tau_x': [],
-            'tau_y': [],
-            'tau_z': [],
-        }
-        self.variables_to_log = getattr(controller, 'variables_to_log', [])
-        for key in self.variables_to_log:
-            if key in self.data.keys():
-                raise Exception(f'Trying to log duplicate variable {key} (choose a different name)')
-            self.data[key] = []
+        # Events that stop the simulation early (if they occur)
+        if termination_events is None:
+            termination_events = []
+        for event in termination_events:
+            if event not in ['landed', 'crashed', 'out_of_bounds']:
+                raise Exception(f'Invalid termination event "{event}" ' + \
+                                 '(choose "landed", "crashed", or "out_of_bounds")')
+        self.termination_events = list(termination_events)
+        self.termination_event = None
+
+        self.logger = DataLogger([
+            't',
+            'p_x',
+            'p_y',
+            'p_z',
+            'psi',
+            'theta',
+            'phi',
+            'v_x',
+            'v_y',
+            'v_z',
+            'w_x',
+            'w_y',
+            'w_z',
+            'delta_r_command',
+            'delta_l_command',
+            'delta_r',
+            'delta_l',
+            'f_x',
+            'f_y',
+            'f_z',
+            'tau_x',
+            'tau_y',
+            'tau_z',
+        ], controller)
 
         # Always start from zero time
         self.t = 0.
         self.time_step = 0
         self.maximum_time_steps = 1 + int(maximum_time / self.dt)
-        self.start_time = time.time()
-
-        if video_filename is not None:
-            # Import imageio
-            imageio = importlib.import_module('imageio')
-
-            # Open video
-            fps = 25
-            if int(1 / self.dt) % fps != 0:
-                raise Exception(f'To create a video, 1 / dt ({1 / self.dt}) must be an ' + \
-                                 'integer that is divisible by fps ({fps})')
-            if print_debug:
-                print(f'Creating a video with name {video_filename} and fps {fps}')
-            w = imageio.get_writer(video_filename,
-                                   format='FFMPEG',
-                                   mode='I',
-                                   fps=fps)
-
-            # Add first frame to video
-            rgba = self.snapshot()
-            w.append_data(rgba)
-
-        while True:
-            all_done = self.step(controller)
-
-            self._update_display()
-
-            if video_filename is not None:
-                if self.time_step % 100 == 0:
-                    if print_debug:
-                        print(f' {self.time_step} / {self.maximum_time_steps}')
-
-                # Add frame to video
-                if self.time_step % int(1 / (self.dt * fps)) == 0:
-                    rgba = self.snapshot()
-                    w.append_data(rgba)
-
-            if all_done:
-                break
-
-            if (self.maximum_time_steps is not None) and (self.time_step == self.maximum_time_steps):
-                break
+        self.pacer.reset()
 
-        if video_filename is not None:
-            # Close video
-            w.close()
+        # Take time steps until done
+        run_loop(
+            self,
+            lambda: self.step(controller),
+            max_time_steps=self.maximum_time_steps,
+            update_display=self._update_display,
+            snapshot=self.snapshot,
+            video_filename=video_filename,
+            fps=25,
+            print_every=100,
+            print_debug=print_debug,
+        )
 
+        # Save data (if necessary) and return it as numpy arrays
+        self.data = self.logger.get_lists()
         if data_filename is not None:
-            with open(data_filename, 'w') as f:
-                json.dump(self.data, f)
-
-        stop_time = time.time()
-        stop_time_step = self.time_step
-
-        elapsed_time = stop_time - self.start_time
-        elapsed_time_steps = stop_time_step
-        if (elapsed_time > 0) and print_debug:
-            print(f'Simulated {elapsed_time_steps} time steps in {elapsed_time:.4f} seconds ' + \
-                  f'({(elapsed_time_steps / elapsed_time):.4f} time steps per second)')
-
-        # convert lists to numpy arrays
-        data = self.data.copy()
-        for key in data.keys():
-            data[key] = np.array(data[key])
-
-        return data
+            self.logger.save(data_filename)
+        return self.logger.get_arrays()
 
     def get_aerodynamic_forces_numeric(self, u, v, w, p, q, r, delta_r, delta_l, params):
-        # Define parameters
-        rho, S, c, b, g = params['rho'], params['S'], params['c'], params['b'], params['g']
-        C_L_0, C_L_alpha, C_L_q, C_L_delta_e = params['C_L_0'], params['C_L_alpha'], params['C_L_q'], params['C_L_delta_e']
-        C_D_0, C_D_alpha, C_D_q, C_D_delta_e = params['C_D_0'], params['C_D_alpha'], params['C_D_q'], params['C_D_delta_e']
-        C_m_0, C_m_alpha, C_m_q, C_m_delta_e = params['C_m_0'], params['C_m_alpha'], params['C_m_q'], params['C_m_delta_e']
-        C_Y_0, C_Y_beta, C_Y_p, C_Y_r, C_Y_delta_a = params['C_Y_0'], params['C_Y_beta'], params['C_Y_p'], params['C_Y_r'], params['C_Y_delta_a']
-        C_l_0, C_l_beta, C_l_p, C_l_r, C_l_delta_a = params['C_l_0'], params['C_l_beta'], params['C_l_p'], params['C_l_r'], params['C_l_delta_a']
-        C_n_0, C_n_beta, C_n_p, C_n_r, C_n_delta_a = params['C_n_0'], params['C_n_beta'], params['C_n_p'], params['C_n_r'], params['C_n_delta_a']
-        e, alpha_0, C_D_p, M = params['e'], params['alpha_0'], params['C_D_p'], params['M']
-        k, k_e = params['k'], params['k_e']
-
-        # Get airspeed, angle of attack, and angle of sideslip
-        V_a = np.sqrt(u**2 + v**2 + w**2)
-        if np.isclose(V_a, 0.):
-            return 0., 0., 0., 0., 0., 0.
-        if np.isclose(u, 0.):
-            alpha = np.sign(u * w) * (np.pi / 2) # <-- attempting to make alpha have the correct sign
-        else:
-            alpha = np.atan(w / u)
-        beta = np.asin(v / V_a)
-
-        # Convert from right and left elevons to elevator and aileron
-        delta_e = (delta_r + delta_l) / 2
-        delta_a = (-delta_r + delta_l) / 2
+        # Use the same aerodynamic model as the trim and linearization engine
+        # (with a batch of one state)
+        forces = get_aerodynamic_forces_vectorized(u, v, w, p, q, r, delta_r, delta_l, params)
+        return tuple(float(f) for f in forces)
 
-        # Longitudinal aerodynamics
-        sigma = (1. + np.exp(-M * (alpha - alpha_0)) + np.exp(M * (alpha + alpha_0))) / ((1. + np.exp(-M * (alpha - alpha_0))) * (1. + np.exp(M * (alpha + alpha_0))))
-        C_L = (1 - sigma) * (C_L_0 + C_L_alpha * alpha) + sigma * (2. * np.sign(alpha) * (np.sin(alpha)**2) * np.cos(alpha))
-        F_lift = rho * V_a**2 * S * (C_L + C_L_q * (c / (2 * V_a)) * q + C_L_delta_e * delta_e) / 2
-        F_drag = rho * V_a**2 * S * ((C_D_0 + k * C_L**2) + C_D_q * (c / (2 * V_a)) * q + k_e * (C_L_delta_e * delta_e)**2) / 2
-        f_x, f_z = np.array([[np.cos(alpha), -np.sin(alpha)], [np.sin(alpha), np.cos(alpha)]]) @ np.array([-F_drag, -F_lift])
-        m_y = rho * V_a**2 * S * c * (C_m_0 + C_m_alpha * alpha + C_m_q * (c / (2 * V_a)) * q + C_m_delta_e * delta_e) / 2
-
-        # Lateral aerodynamics (no rudder)
-        f_y = rho * V_a**2 * S * (C_Y_0 + C_Y_beta * beta + C_Y_p * (b / (2 * V_a)) * p + C_Y_r * (b / (2 * V_a)) * r + C_Y_delta_a * delta_a) / 2
-        m_x = rho * V_a**2 * S * b * (C_l_0 + C_l_beta * beta + C_l_p * (b / (2 * V_a)) * p + C_l_r * (b / (2 * V_a)) * r + C_l_delta_a * delta_a) / 2
-        m_z = rho * V_a**2 * S * b * (C_n_0 + C_n_beta * beta + C_n_p * (b / (2 * V_a)) * p + C_n_r * (b / (2 * V_a)) * r + C_n_delta_a * delta_a) / 2
-
-        return f_x, f_y, f_z, m_x, m_y, m_z
+    def get_linear_models(self, airspeeds, method='complex-step'):
+        # Trim and linearize with this simulator's own parameters
+        return get_linear_models(airspeeds, self.params, method=method)
 
     def step(self, controller):
-        # Never stop early
+        # Stop early only if a termination event occurs
         all_done = False
 
         # Get the current time
@@ -476,6 +832,46 @@ class Simulator:
 
         # Get the sensor measurements
         p_x, p_y, p_z, psi, theta, phi, v_x, v_y, v_z, w_x, w_y, w_z = self.get_sensor_measurements()
+
+        # Check termination events (cheap, because they only use the sensor
+        # measurements we already have) and, if any has occurred, log the
+        # final state and stop before applying any commands or forces - so
+        # nothing is left queued in pybullet for the next run
+        for event in self.termination_events:
+            if event == 'landed':
+                all_done = self._has_landed(p_x, p_y, p_z, v_x, v_y, v_z)
+            elif event == 'crashed':
+                all_done = self._has_crashed(p_z)
+            elif event == 'out_of_bounds':
+                all_done = self._is_out_of_bounds(p_x, p_y)
+            if all_done:
+                self.termination_event = event
+                self.logger.log(
+                    self.t,
+                    p_x,
+                    p_y,
+                    p_z,
+                    psi,
+                    theta,
+                    phi,
+                    v_x,
+                    v_y,
+                    v_z,
+                    w_x,
+                    w_y,
+                    w_z,
+                    np.nan,
+                    np.nan,
+                    self.delta_r,
+                    self.delta_l,
+                    np.nan,
+                    np.nan,
+                    np.nan,
+                    np.nan,
+                    np.nan,
+                    np.nan,
+                )
+                return all_done
         
         # Get the actuator commands
         delta_r_command, delta_l_command = controller.run(
@@ -509,42 +905,35 @@ class Simulator:
         )
 
         # Log data
-        self.data['t'].append(self.t)
-        self.data['p_x'].append(p_x)
-        self.data['p_y'].append(p_y)
-        self.data['p_z'].append(p_z)
-        self.data['psi'].append(psi)
-        self.data['theta'].append(theta)
-        self.data['phi'].append(phi)
-        self.data['v_x'].append(v_x)
-        self.data['v_y'].append(v_y)
-        self.data['v_z'].append(v_z)
-        self.data['w_x'].append(w_x)
-        self.data['w_y'].append(w_y)
-        self.data['w_z'].append(w_z)
-        self.data['delta_r_command'].append(delta_r_command)
-        self.data['delta_l_command'].append(delta_l_command)
-        self.data['delta_r'].append(delta_r)
-        self.data['delta_l'].append(delta_l)
-        self.data['f_x'].append(f_x)
-        self.data['f_y'].append(f_y)
-        self.data['f_z'].append(f_z)
-        self.data['tau_x'].append(tau_x)
-        self.data['tau_y'].append(tau_y)
-        self.data['tau_z'].append(tau_z)
-        for key in self.variables_to_log:
-            val = getattr(controller, key, np.nan)
-            if not np.isscalar(val):
-                val = val.flatten().tolist()
-            self.data[key].append(val)
+        self.logger.log(
+            self.t,
+            p_x,
+            p_y,
+            p_z,
+            psi,
+            theta,
+            phi,
+            v_x,
+            v_y,
+            v_z,
+            w_x,
+            w_y,
+            w_z,
+            delta_r_command,
+            delta_l_command,
+            delta_r,
+            delta_l,
+            f_x,
+            f_y,
+            f_z,
+            tau_x,
+            tau_y,
+            tau_z,
+        )
 
         # Try to stay real-time
         if self.display_meshcat:
-            t = self.start_time + (self.dt * (self.time_step + 1))
-            time_to_wait = t - time.time()
-            while time_to_wait > 0:
-                time.sleep(0.75 * time_to_wait)
-                time_to_wait = t - time.time()
+            self.pacer.wait(self.time_step + 1)
 
         # Take a simulation step
         self.bullet_client.stepSimulation()
@@ -626,17 +1015,10 @@ class Simulator:
         self._update_display()
     
     def _wxyz_from_xyzw(self, xyzw):
-        return np.roll(xyzw, 1)
+        return wxyz_from_xyzw(xyzw)
 
     def _convert_color(self, rgba):
-        color = int(rgba[0] * 255) * 256**2 + int(rgba[1] * 255) * 256 + int(rgba[2] * 255)
-        opacity = rgba[3]
-        transparent = opacity != 1.0
-        return {
-            'color': color,
-            'opacity': opacity,
-            'transparent': transparent,
-        }
+        return convert_color(rgba)
 
     def meshcat_lights(self):
         # As of 1/21/2025, meshcat-python has a bug that does not allow
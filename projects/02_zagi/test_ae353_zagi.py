@@ -0,0 +1,99 @@
+from pathlib import Path
+import shutil
+import numpy as np
+import pytest
+
+import ae353_zagi
+
+
+directory = Path(__file__).resolve().parent
+
+
+class ConstantController:
+    def reset(self):
+        pass
+
+    def run(self, t, *state):
+        return -0.3, -0.3
+
+
+@pytest.fixture(autouse=True)
+def run_in_project_directory(monkeypatch, tmp_path):
+    # The simulator loads its URDF files relative to the current directory
+    # - if the mesh of the zagi is not available, run from a copy of the urdf
+    #   folder that uses the cube mesh in its place (the aerodynamics do not
+    #   depend on the mesh, and these tests only compare runs to each other)
+    if (directory / 'urdf' / 'flying-wing.stl').exists():
+        monkeypatch.chdir(directory)
+    else:
+        shutil.copytree(directory / 'urdf', tmp_path / 'urdf')
+        shutil.copyfile(tmp_path / 'urdf' / 'cube.stl', tmp_path / 'urdf' / 'flying-wing.stl')
+        monkeypatch.chdir(tmp_path)
+
+
+def test_monte_carlo_is_same_in_serial_and_parallel():
+    seeds = range(6)
+    serial = ae353_zagi.run_monte_carlo(
+        ConstantController(), seeds=seeds, maximum_time=30., number_of_processes=1,
+    )
+    parallel = ae353_zagi.run_monte_carlo(
+        ConstantController(), seeds=seeds, maximum_time=30., number_of_processes=3,
+    )
+    assert np.array_equal(serial['landed'], parallel['landed'])
+    assert np.array_equal(serial['final_time'], parallel['final_time'])
+
+
+def test_reused_simulator_is_same_as_new_simulator():
+    # Leave a run (that ends with a termination event) in the reused simulator
+    ae353_zagi._monte_carlo_init(ConstantController(), {})
+    ae353_zagi._monte_carlo_run(0, 30.)
+
+    simulator = ae353_zagi._monte_carlo_simulator
+    simulator.rng = np.random.default_rng(1)
+    simulator.reset()
+    data_reused = simulator.run(ConstantController(), maximum_time=30., termination_events=['landed', 'crashed'])
+
+    simulator = ae353_zagi.Simulator(display=False, seed=1)
+    simulator.reset()
+    data_new = simulator.run(ConstantController(), maximum_time=30., termination_events=['landed', 'crashed'])
+
+    for key in data_new:
+        assert np.array_equal(data_reused[key], data_new[key], equal_nan=True)
+
+
+def test_run_stops_at_termination_event_without_commands():
+    simulator = ae353_zagi.Simulator(display=False, seed=0)
+    simulator.reset()
+    data = simulator.run(ConstantController(), maximum_time=30., termination_events=['crashed'])
+    assert simulator.termination_event == 'crashed'
+    assert data['t'][-1] < 30.
+    assert data['p_z'][-1] > simulator.landing_position[2]
+    assert np.all(data['p_z'][:-1] <= simulator.landing_position[2])
+
+    # The final row is logged before the controller runs and forces are applied
+    for key in ['delta_r_command', 'delta_l_command', 'f_x', 'f_y', 'f_z', 'tau_x', 'tau_y', 'tau_z']:
+        assert np.isnan(data[key][-1])
+        assert not np.any(np.isnan(data[key][:-1]))
+
+
+def test_aerodynamic_forces_in_batch_are_same_as_one_at_a_time():
+    params = ae353_zagi.Simulator(display=False, seed=0).params
+    rng = np.random.default_rng(0)
+    states = rng.normal(size=(200, 8)) * [5., 1., 2., 1., 1., 1., 0.3, 0.3]
+    # - include states with zero airspeed and with zero forward speed, which
+    #   are handled separately from the others
+    states[:20, :3] = 0.
+    states[20:40, 0] = 0.
+    forces = np.column_stack(ae353_zagi.get_aerodynamic_forces_vectorized(*states.T, params))
+    for state, force in zip(states, forces):
+        assert np.allclose(ae353_zagi.get_aerodynamic_forces_vectorized(*state, params), force, rtol=1e-12, atol=1e-12)
+    assert np.all(forces[:20] == 0.)
+
+
+def test_linear_models_accept_numpy_parameters():
+    params = ae353_zagi.Simulator(display=False, seed=0).params
+    params_numpy = {name: np.array(value) for name, value in params.items()}
+    models = ae353_zagi.get_linear_models([6., 8.], params)
+    models_numpy = ae353_zagi.get_linear_models(np.array([6., 8.]), params_numpy)
+    for key in models:
+        assert np.array_equal(models[key], models_numpy[key])
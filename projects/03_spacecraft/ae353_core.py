@@ -0,0 +1,189 @@
+import numpy as np
+import time
+import json
+import importlib
+
+
+def wxyz_from_xyzw(xyzw):
+    return np.roll(xyzw, 1)
+
+def convert_color(rgba):
+    color = int(rgba[0] * 255) * 256**2 + int(rgba[1] * 255) * 256 + int(rgba[2] * 255)
+    opacity = rgba[3]
+    transparent = opacity != 1.0
+    return {
+        'color': color,
+        'opacity': opacity,
+        'transparent': transparent,
+    }
+
+
+class DataLogger:
+    """
+    Logs data at each time step as one row of values (one for each key, then
+    one for each variable the controller asks to log). Appending one row is
+    much cheaper than appending to one list for each key. Rows are turned into
+    columns only when the data are needed.
+    """
+
+    def __init__(self, keys, controller=None):
+        self.keys = list(keys)
+        self.controller = controller
+        self.variables_to_log = list(getattr(controller, 'variables_to_log', []))
+        for key in self.variables_to_log:
+            if key in self.keys:
+                raise Exception(f'Trying to log duplicate variable {key} (choose a different name)')
+            self.keys.append(key)
+        self.rows = []
+
+    def log(self, *values):
+        if self.variables_to_log:
+            values += tuple(self._get_controller_values())
+        self.rows.append(values)
+
+    def _get_controller_values(self):
+        for key in self.variables_to_log:
+            val = getattr(self.controller, key, np.nan)
+            if not np.isscalar(val):
+                val = val.flatten().tolist()
+            yield val
+
+    def get_lists(self):
+        """
+        returns a dictionary with a list of logged values for each key
+        """
+        if len(self.rows) == 0:
+            return {key: [] for key in self.keys}
+        return {key: list(column) for key, column in zip(self.keys, zip(*self.rows))}
+
+    def get_arrays(self):
+        """
+        returns a dictionary with a numpy array of logged values for each key
+        """
+        return {key: np.array(column) for key, column in self.get_lists().items()}
+
+    def save(self, filename):
+        with open(filename, 'w') as f:
+            json.dump(self.get_lists(), f)
+
+
+class RealTimePacer:
+    """
+    Keeps a simulation from running faster than real time.
+    """
+
+    def __init__(self, dt, sleep_fraction=0.9):
+        self.dt = dt
+        self.sleep_fraction = sleep_fraction
+        self.start_time = time.time()
+
+    def reset(self, time_step=0):
+        self.start_time = time.time() - (self.dt * time_step)
+
+    def wait(self, time_step):
+        # Wait until the wall-clock time of the given time step
+        t = self.start_time + (self.dt * time_step)
+        time_to_wait = t - time.time()
+        while time_to_wait > 0:
+            time.sleep(self.sleep_fraction * time_to_wait)
+            time_to_wait = t - time.time()
+
+
+class VideoWriter:
+    """
+    Writes frames to a video file with imageio (imported only when needed).
+    """
+
+    def __init__(self, filename, fps, print_debug=False):
+        imageio = importlib.import_module('imageio')
+        if print_debug:
+            print(f'Creating a video with name {filename} and fps {fps}')
+        self.writer = imageio.get_writer(
+            filename,
+            format='FFMPEG',
+            mode='I',
+            fps=fps,
+        )
+
+    def append(self, rgba):
+        self.writer.append_data(rgba)
+
+    def close(self):
+        self.writer.close()
+
+
+def run_loop(
+        simulator,
+        step,
+        max_time_steps=None,
+        update_display=None,
+        snapshot=None,
+        video_filename=None,
+        fps=None,
+        print_every=100,
+        print_debug=False,
+        videos=None,
+    ):
+    """
+    Calls step() - which must take one time step and return True to stop early
+    - until it returns True or simulator.time_step reaches max_time_steps.
+
+    After each time step, calls update_display() (if given). If video_filename
+    is given, also adds a frame from snapshot() to a video with fps frames per
+    second (by default, 1 / simulator.dt). To make more than one video at once,
+    give videos instead - a list of (video_filename, snapshot) pairs.
+    """
+
+    start_time = time.time()
+    start_time_step = simulator.time_step
+
+    videos = [] if videos is None else list(videos)
+    if video_filename is not None:
+        videos.append((video_filename, snapshot))
+
+    writers = []
+    if len(videos) > 0:
+        # Open videos
+        if fps is None:
+            fps = int(1 / simulator.dt)
+        if int(1 / simulator.dt) % fps != 0:
+            raise Exception(f'To create a video, 1 / dt ({1 / simulator.dt}) must be an ' + \
+                             f'integer that is divisible by fps ({fps})')
+        time_steps_per_frame = int(1 / simulator.dt) // fps
+        for filename, video_snapshot in videos:
+            writers.append((VideoWriter(filename, fps, print_debug=print_debug), video_snapshot))
+
+        # Add first frame to each video
+        for writer, video_snapshot in writers:
+            writer.append(video_snapshot())
+
+    while True:
+        all_done = step()
+
+        if update_display is not None:
+            update_display()
+
+        if len(writers) > 0:
+            if (simulator.time_step % print_every == 0) and print_debug:
+                print(f' {simulator.time_step} / {max_time_steps}')
+
+            # Add frame to each video
+            if simulator.time_step % time_steps_per_frame == 0:
+                for writer, video_snapshot in writers:
+                    writer.append(video_snapshot())
+
+        if all_done:
+            break
+
+        if (max_time_steps is not None) and (simulator.time_step == max_time_steps):
+            break
+
+    # Close videos
+    for writer, video_snapshot in writers:
+        writer.close()
+
+    elapsed_time = time.time() - start_time
+    elapsed_time_steps = simulator.time_step - start_time_step
+    if (elapsed_time > 0) and print_debug:
+        print(f'Simulated {elapsed_time_steps} time steps in {elapsed_time:.4f} seconds ' + \
+              f'({(elapsed_time_steps / elapsed_time):.4f} time steps per second)')
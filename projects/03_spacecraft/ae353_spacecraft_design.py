@@ -1,5 +1,4 @@
 import xml.etree.ElementTree as ET
-from xml.dom import minidom
 import numpy as np
 from pathlib import Path
 import meshcat
@@ -7,6 +6,7 @@ from scipy.spatial.transform import Rotation
 import matplotlib.pyplot as plt
 from matplotlib.patches import Circle
 import json
+import hashlib
 
 # Minimum distance between the center of wheel pairs
 min_dist_rw_to_rw = np.sqrt(0.5**2 + 0.1**2) + np.sqrt(0.5**2 + 0.1**2) + 0.001
@@ -20,6 +20,9 @@ min_dist_rw_to_hatch = np.sqrt(0.5**2 + 0.1**2) + np.sqrt(0.3**2 + 0.1**2) + 0.0
 # Distance between center of spacecraft and center of each wheel
 DISTANCE_TO_WHEELS = 2.2
 
+# Maximum torque that can be applied by each wheel (same as in the simulator)
+MAXIMUM_WHEEL_TORQUE = 2.
+
 # Minimum distance between the center of any two stars in the scope
 min_dist_star_to_star = 0.2
 
@@ -41,11 +44,28 @@ def transform_inertia_matrix(m, J_inB_aboutB, R_inC_ofB, p_inC_ofB):
     J_inC_aboutC is the inertia matrix of the rigid body about the origin of C in frame C
     """
     
-    p_inB_ofC = -R_inC_ofB.T @ p_inC_ofB
-    R_inB_ofC = R_inC_ofB.T
+    return transform_inertia_matrices(m, J_inB_aboutB, R_inC_ofB, p_inC_ofB)
+
+def transform_inertia_matrices(m, J_inB_aboutB, R_inC_ofB, p_inC_ofB):
+    """
+    Same as transform_inertia_matrix, but for k rigid bodies at once:
+
+        m has shape (k,)
+        J_inB_aboutB has shape (k, 3, 3)
+        R_inC_ofB has shape (k, 3, 3)
+        p_inC_ofB has shape (k, 3)
+
+    (or any shapes that broadcast to these) and the result has shape (k, 3, 3).
+    """
 
-    J_inB_aboutC = J_inB_aboutB + m * ((np.inner(p_inB_ofC, p_inB_ofC) * np.eye(3) - np.outer(p_inB_ofC, p_inB_ofC)))
-    J_inC_aboutC = R_inC_ofB @ J_inB_aboutC @ R_inB_ofC
+    m = np.asarray(m, dtype=float)
+    p = np.asarray(p_inC_ofB, dtype=float)
+
+    # Rotate into frame C, then shift from the origin of B to the origin of C
+    # (parallel axis theorem)
+    J_inC_aboutB = np.einsum('...ij,...jk,...lk->...il', R_inC_ofB, J_inB_aboutB, R_inC_ofB)
+    J_shift = np.einsum('...i,...i->...', p, p)[..., None, None] * np.eye(3) - np.einsum('...i,...j->...ij', p, p)
+    J_inC_aboutC = J_inC_aboutB + m[..., None, None] * J_shift
 
     return J_inC_aboutC
 
@@ -62,83 +82,50 @@ def get_wheel_inertias(wheels, m_w=1., r_w=0.5, h_w=0.2):
         w['J'] = np.diag([Jx, Jx, Jz])
     
     # In body frame about body center (all wheels together)
-    m_wheels = 0.
-    c_wheels = np.zeros(3)
-    J_wheels = np.zeros((3, 3))
-    for w in wheels:
-        m_wheels += w['m']
-        c_wheels += w['xyz'] * w['m']
-        J_wheels += transform_inertia_matrix(w['m'], w['J'], w['R_inC_ofB'], w['p_inC_ofB'])
-    c_wheels /= m_wheels
+    m = np.array([w['m'] for w in wheels])
+    J = np.array([w['J'] for w in wheels])
+    R_inC_ofB = np.array([w['R_inC_ofB'] for w in wheels])
+    p_inC_ofB = np.array([w['p_inC_ofB'] for w in wheels])
+    m_wheels = np.sum(m)
+    c_wheels = (m @ p_inC_ofB) / m_wheels
+    J_wheels = np.sum(transform_inertia_matrices(m, J, R_inC_ofB, p_inC_ofB), axis=0)
 
     return m_wheels, J_wheels, c_wheels
 
 def get_masses(m_wheels, J_wheels, c_wheels):
-    masses = []
-    J = J_wheels.copy()
-    m = m_wheels
-    
     # Move center of mass to body center
-    mass = {
+    masses = [{
         'm': m_wheels,
         'p': -c_wheels,
-    }
-    m += mass['m']
-    J += transform_inertia_matrix(mass['m'], np.zeros((3, 3)), np.eye(3), mass['p'])
-    masses.append(mass)
+    }]
+    J = J_wheels + transform_inertia_matrices(m_wheels, np.zeros((3, 3)), np.eye(3), -c_wheels)
 
-    # Eliminate off-diagonal elements of inertia matrix
+    # Eliminate off-diagonal elements of inertia matrix with pairs of masses,
+    # each of which cancels one off-diagonal element without changing others
     # - xy
     m_mass = 1.
     r_mass = np.sqrt(np.abs(J[0, 1]) / (2 * m_mass))
-    mass = {
-        'm': m_mass,
-        'p': np.array([np.sign(J[0, 1]) * r_mass, r_mass, 0.])
-    }
-    m += mass['m']
-    J += transform_inertia_matrix(mass['m'], np.zeros((3, 3)), np.eye(3), mass['p'])
-    masses.append(mass)
-    mass = {
-        'm': m_mass,
-        'p': - np.array([np.sign(J[0, 1]) * r_mass, r_mass, 0.])
-    }
-    m += mass['m']
-    J += transform_inertia_matrix(mass['m'], np.zeros((3, 3)), np.eye(3), mass['p'])
-    masses.append(mass)
+    p = np.array([np.sign(J[0, 1]) * r_mass, r_mass, 0.])
+    masses.append({'m': m_mass, 'p': p})
+    masses.append({'m': m_mass, 'p': -p})
     # - xz
     m_mass = 1.
     r_mass = np.sqrt(np.abs(J[0, 2]) / (2 * m_mass))
-    mass = {
-        'm': m_mass,
-        'p': np.array([np.sign(J[0, 2]) * r_mass, 0., r_mass]) #<-- FIXME
-    }
-    m += mass['m']
-    J += transform_inertia_matrix(mass['m'], np.zeros((3, 3)), np.eye(3), mass['p'])
-    masses.append(mass)
-    mass = {
-        'm': m_mass,
-        'p': - np.array([np.sign(J[0, 2]) * r_mass, 0., r_mass]) #<-- FIXME
-    }
-    m += mass['m']
-    J += transform_inertia_matrix(mass['m'], np.zeros((3, 3)), np.eye(3), mass['p'])
-    masses.append(mass)
+    p = np.array([np.sign(J[0, 2]) * r_mass, 0., r_mass]) #<-- FIXME
+    masses.append({'m': m_mass, 'p': p})
+    masses.append({'m': m_mass, 'p': -p})
     # - yz
     m_mass = 1.
     r_mass = np.sqrt(np.abs(J[1, 2]) / (2 * m_mass))
-    mass = {
-        'm': m_mass,
-        'p': np.array([0., np.sign(J[1, 2]) * r_mass, r_mass])
-    }
-    m += mass['m']
-    J += transform_inertia_matrix(mass['m'], np.zeros((3, 3)), np.eye(3), mass['p'])
-    masses.append(mass)
-    mass = {
-        'm': m_mass,
-        'p': - np.array([0., np.sign(J[1, 2]) * r_mass, r_mass])
-    }
-    m += mass['m']
-    J += transform_inertia_matrix(mass['m'], np.zeros((3, 3)), np.eye(3), mass['p'])
-    masses.append(mass)
+    p = np.array([0., np.sign(J[1, 2]) * r_mass, r_mass])
+    masses.append({'m': m_mass, 'p': p})
+    masses.append({'m': m_mass, 'p': -p})
+
+    # Add all masses (as point masses) at once
+    m_masses = np.array([mass['m'] for mass in masses])
+    p_masses = np.array([mass['p'] for mass in masses])
+    m = m_wheels + np.sum(m_masses)
+    J = J_wheels + np.sum(transform_inertia_matrices(m_masses, np.zeros((3, 3)), np.eye(3), p_masses), axis=0)
     
     return m, J, masses
 
@@ -320,7 +307,13 @@ def get_inertial_parameters(J):
     ixz = J[0, 2]
     return [ixx, ixy, ixz, iyy, iyz, izz]
 
-def create_spacecraft(wheels, urdf='spacecraft.urdf'):
+def get_spacecraft_urdf(wheels):
+    """
+    returns the URDF that describes a spacecraft with the given wheels (as a
+    string, without writing anything to disk) along with the total mass and
+    inertia matrix of the spacecraft
+    """
+
     # Geometry
     if not wheels_are_valid(wheels):
         raise Exception('Invalid placement of reaction wheels')
@@ -370,11 +363,178 @@ def create_spacecraft(wheels, urdf='spacecraft.urdf'):
     add_wheel_joints(robot, wheels)
     add_mass_joints(robot, masses)
 
-    xmlstr = minidom.parseString(ET.tostring(robot)).toprettyxml(indent="  ")
-    with open(Path(f'./urdf/{urdf}'), 'w') as f:
-        f.write(xmlstr)
+    ET.indent(robot, space='  ')
+    xmlstr = '<?xml version="1.0" ?>\n' + ET.tostring(robot, encoding='unicode') + '\n'
     
-    return m_with_wheels, J_with_wheels.round(decimals=8)
+    return xmlstr, m_with_wheels, J_with_wheels.round(decimals=8)
+
+# Hash of the content of each URDF written by write_urdf
+_urdf_hashes = {}
+
+def write_urdf(xmlstr, urdf=None):
+    """
+    writes the URDF in xmlstr to ./urdf/{urdf} (by default, to a file named
+    after a hash of its content) and returns the path - the file is not
+    written again if it already has the same content
+
+    Files named by hash are never removed, so one is left in ./urdf for each
+    different design - delete ./urdf/spacecraft-*.urdf to clean them up.
+    """
+    content_hash = hashlib.sha1(xmlstr.encode('utf-8')).hexdigest()
+    is_named_by_hash = urdf is None
+    if is_named_by_hash:
+        urdf = f'spacecraft-{content_hash[:16]}.urdf'
+    path = Path(f'./urdf/{urdf}')
+    if path.exists() and (is_named_by_hash or (_urdf_hashes.get(path) == content_hash)):
+        return path
+    with open(path, 'w') as f:
+        f.write(xmlstr)
+    _urdf_hashes[path] = content_hash
+    return path
+
+def create_spacecraft(wheels, urdf='spacecraft.urdf'):
+    xmlstr, m_with_wheels, J_with_wheels = get_spacecraft_urdf(wheels)
+    write_urdf(xmlstr, urdf)
+    return m_with_wheels, J_with_wheels
+
+def get_wheel_positions(alpha, delta, r=DISTANCE_TO_WHEELS):
+    """
+    alpha and delta are (k, 4) arrays with the right ascension and declination
+    of each wheel in each of k candidate layouts
+
+    returns a (k, 4, 3) array with the position of each wheel in the body frame
+    """
+    alpha = np.reshape(alpha, (-1, 4))
+    delta = np.reshape(delta, (-1, 4))
+    return r * np.stack([
+        np.cos(alpha) * np.cos(delta),
+        np.sin(alpha) * np.cos(delta),
+        np.sin(delta),
+    ], axis=-1)
+
+def wheel_layouts_are_valid(xyz):
+    """
+    same checks as wheels_are_valid for a (k, 4, 3) array of wheel positions
+    (without printing warnings) - returns a boolean array of length k
+    """
+    scope_xyz = DISTANCE_TO_WHEELS * np.array([1., 0., 0.])
+    hatch_xyz = DISTANCE_TO_WHEELS * np.array([0., 0., 1.])
+    i, j = np.triu_indices(xyz.shape[1], k=1)
+    valid = np.all(np.linalg.norm(xyz - scope_xyz, axis=-1) > min_dist_rw_to_scope, axis=-1)
+    valid &= np.all(np.linalg.norm(xyz - hatch_xyz, axis=-1) > min_dist_rw_to_hatch, axis=-1)
+    valid &= np.all(np.linalg.norm(xyz[:, i] - xyz[:, j], axis=-1) > min_dist_rw_to_rw, axis=-1)
+    return valid
+
+def get_layout_mass_properties(xyz, m_w=1., r_w=0.5, h_w=0.2):
+    """
+    same as get_mass_properties for a (k, 4, 3) array of wheel positions
+
+    returns an array of length k with the total mass and a (k, 3, 3) array with
+    the total inertia matrix of each layout (including the masses placed by
+    get_masses)
+    """
+    # Mass and inertia of spacecraft alone
+    m_spacecraft, J_spacecraft = get_spacecraft_inertia()
+
+    # Mass and inertia of wheels alone, in body frame about body center - the
+    # spin axis of each wheel points from body center to wheel center, so its
+    # inertia about its own center is Jx * I + (Jz - Jx) * a a^T
+    Jx = (1. / 12.) * m_w * (3 * r_w**2 + h_w**2)
+    Jz = (1. / 2.) * m_w * r_w**2
+    a = xyz / np.linalg.norm(xyz, axis=-1, keepdims=True)
+    J_inC_aboutB = Jx * np.eye(3) + (Jz - Jx) * a[..., :, None] * a[..., None, :]
+    J_wheels = np.sum(transform_inertia_matrices(m_w, J_inC_aboutB, np.eye(3), xyz), axis=1)
+    m_wheels = m_w * xyz.shape[1]
+    c_wheels = np.mean(xyz, axis=1)
+
+    # Move center of mass to body center
+    J = J_wheels + transform_inertia_matrices(m_wheels, np.zeros((3, 3)), np.eye(3), -c_wheels)
+
+    # Eliminate off-diagonal elements of inertia matrix - each pair of unit
+    # masses placed by get_masses cancels one off-diagonal element and adds
+    # its magnitude to the diagonal elements
+    J_xy = np.abs(J[:, 0, 1])
+    J_xz = np.abs(J[:, 0, 2])
+    J_yz = np.abs(J[:, 1, 2])
+    J_with_wheels = np.zeros_like(J)
+    J_with_wheels[:, 0, 0] = J[:, 0, 0] + J_xy + J_xz + 2 * J_yz
+    J_with_wheels[:, 1, 1] = J[:, 1, 1] + J_xy + 2 * J_xz + J_yz
+    J_with_wheels[:, 2, 2] = J[:, 2, 2] + 2 * J_xy + J_xz + J_yz
+    m_with_wheels = np.full(xyz.shape[0], 2 * m_wheels + 6.)
+
+    # Get total mass and inertia
+    return m_spacecraft + m_with_wheels, J_spacecraft + J_with_wheels
+
+def get_inscribed_radius(B):
+    """
+    B is a (k, 3, n) array - returns a 1d array of length k with the radius of the
+    largest ball (centered at the origin) that is contained in the set of all B u
+    with every element of u between -1 and 1 (zero if B does not have full rank)
+    """
+    # Each facet of this set (a zonotope) is normal to the cross product of
+    # two of its generators (the columns of B)
+    i, j = np.triu_indices(B.shape[2], k=1)
+    normals = np.cross(B[:, :, i], B[:, :, j], axis=1)
+    norms = np.linalg.norm(normals, axis=1)
+    support = np.sum(np.abs(np.einsum('kdp,kdn->kpn', normals, B)), axis=2)
+    is_facet = norms > 1e-12
+    distance = np.where(is_facet, support / np.where(is_facet, norms, 1.), np.inf)
+    radius = np.min(distance, axis=1)
+    radius[np.isinf(radius)] = 0.
+    return radius
+
+def evaluate_wheel_layouts(alpha, delta, tau_max=MAXIMUM_WHEEL_TORQUE):
+    """
+    alpha and delta are (k, 4) arrays with the right ascension and declination
+    of each wheel in each of k candidate layouts
+
+    returns a dictionary of arrays with the validity, total mass, total inertia
+    matrix, and actuation matrix (torque on the spacecraft is B @ [tau_1, ...,
+    tau_4]) of each layout, along with two metrics:
+
+        torque_envelope         largest torque that can be applied in any direction
+        acceleration_envelope   largest angular acceleration that can be produced
+                                in any direction (starting from rest)
+
+    both of which are zero if the wheels cannot apply torque in all directions
+    """
+    alpha = np.reshape(alpha, (-1, 4))
+    delta = np.reshape(delta, (-1, 4))
+    xyz = get_wheel_positions(alpha, delta)
+    valid = wheel_layouts_are_valid(xyz)
+    m, J = get_layout_mass_properties(xyz)
+    B = - np.swapaxes(xyz / np.linalg.norm(xyz, axis=-1, keepdims=True), 1, 2)
+    return {
+        'alpha': alpha,
+        'delta': delta,
+        'valid': valid,
+        'm': m,
+        'J': J,
+        'B': B,
+        'rank': np.linalg.matrix_rank(B),
+        'torque_envelope': tau_max * get_inscribed_radius(B),
+        'acceleration_envelope': tau_max * get_inscribed_radius(np.linalg.solve(J, B)),
+    }
+
+def get_best_wheel_layouts(alpha, delta, number_of_layouts=1, metric='acceleration_envelope'):
+    """
+    ranks the valid layouts in (k, 4) arrays alpha and delta by the given metric
+    (see evaluate_wheel_layouts) and returns the best ones, each as a list of
+    wheels that can be passed to create_spacecraft
+    """
+    if metric not in ['torque_envelope', 'acceleration_envelope']:
+        raise Exception(f'Invalid metric "{metric}" (choose "torque_envelope" or "acceleration_envelope")')
+    results = evaluate_wheel_layouts(alpha, delta)
+    score = np.where(results['valid'], results[metric], -np.inf)
+    layouts = []
+    for i in np.argsort(-score, kind='stable')[:number_of_layouts]:
+        if not results['valid'][i]:
+            break
+        layouts.append([
+            {'alpha': float(alpha_i), 'delta': float(delta_i)}
+            for alpha_i, delta_i in zip(results['alpha'][i], results['delta'][i])
+        ])
+    return layouts
 
 def convert_color(rgba):
     color = int(rgba[0] * 255) * 256**2 + int(rgba[1] * 255) * 256 + int(rgba[2] * 255)
@@ -478,31 +638,69 @@ def plot_alpha(ax, alpha, scope_radius, z_lim=-1.1):
     ax.plot(y, z, color='w', linewidth=0.5)
     return y_tick
 
+def get_star_violations(stars):
+    """
+    returns a list of pairs (i, j) of stars that are too close to each other and
+    a list of stars i that are out of view (numbering stars from 1)
+    """
+    alpha = np.array([s['alpha'] for s in stars], dtype=float)
+    delta = np.array([s['delta'] for s in stars], dtype=float)
+
+    # Project all stars once
+    y, z = project_star(alpha, delta, scope_radius)
+
+    # Check if stars are too close to each other
+    d = np.sqrt((y[:, None] - y[None, :])**2 + (z[:, None] - z[None, :])**2)
+    i, j = np.nonzero(np.triu(d <= min_dist_star_to_star, k=1))
+    too_close = [(int(i_k) + 1, int(j_k) + 1) for i_k, j_k in zip(i, j)]
+
+    # Check if stars are outside scope
+    out_of_view = [int(i_k) + 1 for i_k in np.nonzero(y**2 + z**2 > 1.)[0]]
+
+    return too_close, out_of_view
+
 def stars_are_valid(stars):
-    valid = True
-    
     if len(stars) > 10:
         raise Exception(f'There must be at most ten stars (you defined {len(stars)}).')
 
-    # Check if stars are too close to each other
-    for i, s_i in enumerate(stars):
-        for j, s_j in enumerate(stars):
-            if j <= i:
-                continue
-            y_i, z_i = project_star(s_i['alpha'], s_i['delta'], scope_radius)
-            y_j, z_j = project_star(s_j['alpha'], s_j['delta'], scope_radius)
-            if np.linalg.norm(np.array([y_i - y_j, z_i - z_j])) <= min_dist_star_to_star:
-                print(f'WARNING: STAR {i + 1} is too close to STAR {j + 1}')
-                valid = False
-    
-    # Check if stars are outside scope
-    for i, s_i in enumerate(stars):
-        y_i, z_i = project_star(s_i['alpha'], s_i['delta'], scope_radius)
-        if y_i**2 + z_i**2 > 1.:
-            print(f'WARNING: STAR {i + 1} is out of view')
-            valid = False
+    too_close, out_of_view = get_star_violations(stars)
+    for i, j in too_close:
+        print(f'WARNING: STAR {i} is too close to STAR {j}')
+    for i in out_of_view:
+        print(f'WARNING: STAR {i} is out of view')
 
-    return valid
+    return (len(too_close) == 0) and (len(out_of_view) == 0)
+
+def evaluate_star_layouts(alpha, delta):
+    """
+    alpha and delta are (k, n) arrays with the right ascension and declination
+    of each of n stars in each of k candidate layouts
+
+    returns a dictionary of arrays of length k with the validity of each layout,
+    its number of violations (pairs of stars that are too close plus stars out
+    of view), the smallest distance between any two stars in the scope, and the
+    largest distance from any star to the center of the scope
+    """
+    alpha = np.atleast_2d(alpha)
+    delta = np.atleast_2d(delta)
+    if alpha.shape[1] > 10:
+        raise Exception(f'There must be at most ten stars (you defined {alpha.shape[1]}).')
+
+    # Project all stars in all layouts at once
+    y, z = project_star(alpha, delta, scope_radius)
+
+    # Distance between each pair of stars and from each star to scope center
+    i, j = np.triu_indices(alpha.shape[1], k=1)
+    d = np.sqrt((y[:, i] - y[:, j])**2 + (z[:, i] - z[:, j])**2)
+    r = np.sqrt(y**2 + z**2)
+
+    number_of_violations = np.sum(d <= min_dist_star_to_star, axis=1) + np.sum(r > 1., axis=1)
+    return {
+        'valid': number_of_violations == 0,
+        'number_of_violations': number_of_violations,
+        'min_star_to_star': np.min(d, axis=1, initial=np.inf),
+        'max_star_to_center': np.max(r, axis=1, initial=0.),
+    }
 
 def show_stars_on_axis(stars, ax, show_alpha_delta_scale):
     dark_yellow = [1.0, 0.8196078431, 0.1450980392]
@@ -3,11 +3,262 @@ import pybullet
 from pybullet_utils import bullet_client
 import time
 import json
-import importlib
 import meshcat
 from pathlib import Path
 import umsgpack
+import multiprocessing
+from ae353_actuators import TorqueActuators
+from ae353_core import DataLogger, RealTimePacer, run_loop, wxyz_from_xyzw, convert_color
+
+
+def get_rotation_matrices(rpy):
+    """
+    returns a (k, 3, 3) numpy array with the orientation of the body frame in
+    the world frame for each of k rows of roll, pitch, and yaw angles (using
+    the same convention as pybullet)
+    """
+    rpy = np.reshape(rpy, (-1, 3))
+    cr, cp, cy = np.cos(rpy).T
+    sr, sp, sy = np.sin(rpy).T
+    R = np.empty((rpy.shape[0], 3, 3))
+    R[:, 0, 0] = cy * cp
+    R[:, 0, 1] = cy * sp * sr - sy * cr
+    R[:, 0, 2] = cy * sp * cr + sy * sr
+    R[:, 1, 0] = sy * cp
+    R[:, 1, 1] = sy * sp * sr + cy * cr
+    R[:, 1, 2] = sy * sp * cr - cy * sr
+    R[:, 2, 0] = -sp
+    R[:, 2, 1] = cp * sr
+    R[:, 2, 2] = cp * cr
+    return R
+
+def get_rotation_matrix_and_rpy(quaternion):
+    """
+    returns the 3x3 rotation matrix and the roll, pitch, and yaw angles that
+    correspond to quaternion (x, y, z, w), computed in the same way as by
+    pybullet.getMatrixFromQuaternion and pybullet.getEulerFromQuaternion
+    """
+    x, y, z, w = quaternion
+
+    # rotation matrix
+    s = 2. / (x**2 + y**2 + z**2 + w**2)
+    R = np.array([
+        [1. - s * (y**2 + z**2), s * (x * y - w * z), s * (x * z + w * y)],
+        [s * (x * y + w * z), 1. - s * (x**2 + z**2), s * (y * z - w * x)],
+        [s * (x * z - w * y), s * (y * z + w * x), 1. - s * (x**2 + y**2)],
+    ])
+
+    # roll, pitch, and yaw angles
+    sarg = -2. * (x * z - w * y)
+    if sarg <= -0.99999:
+        rpy = (0., -0.5 * np.pi, 2. * np.arctan2(x, -y))
+    elif sarg >= 0.99999:
+        rpy = (0., 0.5 * np.pi, 2. * np.arctan2(-x, y))
+    else:
+        rpy = (
+            np.arctan2(2. * (y * z + w * x), w**2 - x**2 - y**2 + z**2),
+            np.arcsin(sarg),
+            np.arctan2(2. * (x * y + w * z), w**2 + x**2 - y**2 - z**2),
+        )
 
+    return R, rpy
+
+class StarTrackerObserver:
+    """
+    A reference estimator for benchmark_estimator. At each time step, it finds
+    the roll, pitch, and yaw angles that best explain the star measurements by
+    a few Gauss-Newton iterations (with a finite-difference jacobian), warm
+    started from the previous estimate. It applies no torque.
+    """
+
+    def __init__(self, stars_filename=Path('urdf/stars.json'), scope_radius=0.8 / 2.1, iterations=3):
+        with open(stars_filename, 'r') as f:
+            stars = json.load(f)
+        self.star_directions = np.array([[
+            np.cos(star['alpha']) * np.cos(star['delta']),
+            np.sin(star['alpha']) * np.cos(star['delta']),
+            np.sin(star['delta']),
+        ] for star in stars]).reshape(-1, 3)
+        self.scope_radius = scope_radius
+        self.iterations = iterations
+        self.reset()
+
+    def reset(self):
+        self.rpy = np.zeros(3)
+        self.xhat = np.zeros(3)
+
+    def get_star_meas(self, rpy):
+        # Image coordinates of each star (one row per row of rpy)
+        pos_in_body = self.star_directions @ get_rotation_matrices(rpy)
+        y = (pos_in_body[:, :, 1] / pos_in_body[:, :, 0]) / self.scope_radius
+        z = (pos_in_body[:, :, 2] / pos_in_body[:, :, 0]) / self.scope_radius
+        return np.stack([y, z], axis=-1).reshape(pos_in_body.shape[0], -1)
+
+    def run(self, t, star_meas):
+        h = 1e-6
+        for i in range(self.iterations):
+            # Predicted measurements at the current estimate and at a small
+            # perturbation of each angle (all at once)
+            y = self.get_star_meas(self.rpy + np.vstack([np.zeros(3), h * np.eye(3)]))
+            A = (y[1:] - y[0]).T / h
+            b = star_meas - y[0]
+            self.rpy = self.rpy + np.linalg.lstsq(A, b, rcond=None)[0]
+        self.xhat = np.array([self.rpy[2], self.rpy[1], self.rpy[0]])
+        return 0., 0., 0., 0.
+
+def _benchmark_init(controller, estimate, state_names):
+    global _benchmark_controller, _benchmark_estimate, _benchmark_state_names
+    _benchmark_controller = controller
+    _benchmark_estimate = estimate
+    _benchmark_state_names = state_names
+
+def _benchmark_run(recording):
+    controller = _benchmark_controller
+
+    # Load recording (if necessary)
+    if not isinstance(recording, dict):
+        with open(recording, 'r') as f:
+            recording = json.load(f)
+    t = np.array(recording['t'])
+    star_meas = np.array(recording['star_meas'])
+    x = np.column_stack([recording[name] for name in _benchmark_state_names])
+
+    # Replay star measurements into controller, timing each call
+    if hasattr(controller, 'reset'):
+        controller.reset()
+    latency = np.empty(len(t))
+    xhat = np.empty(x.shape)
+    for i in range(len(t)):
+        start_time = time.perf_counter()
+        controller.run(t[i], star_meas[i])
+        latency[i] = time.perf_counter() - start_time
+        xhat[i] = np.asarray(getattr(controller, _benchmark_estimate)).flatten()
+
+    # Estimation error (wrapped to [-pi, pi) for angles)
+    error = xhat - x
+    for j, name in enumerate(_benchmark_state_names):
+        if name in ['psi', 'theta', 'phi']:
+            error[:, j] = np.mod(error[:, j] + np.pi, 2 * np.pi) - np.pi
+
+    return latency, error
+
+def benchmark_estimator(
+        controller,
+        recordings,
+        estimate='xhat',
+        state_names=('psi', 'theta', 'phi'),
+        number_of_processes=None,
+    ):
+    """
+    Measures the cost and accuracy of the estimator in controller by replaying
+    recorded star measurements into controller.run (without running pybullet).
+
+    Each recording is either the data returned by Simulator.run or the name of
+    a file created by Simulator.run with data_filename. After each call to
+    controller.run, the attribute of controller named by estimate must hold
+    the current estimate of the states in state_names, in that order. These
+    estimates are compared to the states logged in each recording.
+
+    Recordings are split across number_of_processes worker processes (default,
+    one per CPU). The controller is copied to each worker - if it cannot be
+    copied (e.g., on Windows or MacOS when defined in a notebook), use
+    number_of_processes=1 to replay all recordings in this process instead.
+    Latency is measured inside each worker, so use fewer processes than CPUs
+    for the most reliable timing.
+
+    Returns a dictionary with the latency (in seconds) of each call and the
+    estimation error at each time step of each recording, along with summary
+    statistics over all recordings.
+    """
+
+    state_names = list(state_names)
+    if number_of_processes is None:
+        number_of_processes = multiprocessing.cpu_count()
+    number_of_processes = max(1, min(number_of_processes, len(recordings)))
+
+    # Replay all recordings
+    if number_of_processes == 1:
+        _benchmark_init(controller, estimate, state_names)
+        results = [_benchmark_run(recording) for recording in recordings]
+    else:
+        with multiprocessing.Pool(
+                    number_of_processes,
+                    initializer=_benchmark_init,
+                    initargs=(controller, estimate, state_names),
+                ) as pool:
+            results = pool.map(_benchmark_run, recordings)
+    latency = [r[0] for r in results]
+    error = [r[1] for r in results]
+
+    # Summary statistics over all recordings
+    all_latency = np.concatenate(latency)
+    all_error = np.concatenate(error)
+    return {
+        'state_names': state_names,
+        'latency': latency,
+        'error': error,
+        'latency_mean': float(np.mean(all_latency)),
+        'latency_median': float(np.median(all_latency)),
+        'latency_p99': float(np.percentile(all_latency, 99)),
+        'latency_max': float(np.max(all_latency)),
+        'rms_error': np.sqrt(np.mean(all_error**2, axis=0)),
+        'max_error': np.max(np.abs(all_error), axis=0),
+    }
+
+class PybulletCallCounter:
+    """
+    Wraps a pybullet client and counts the number of calls to each function.
+    """
+    def __init__(self, bullet_client):
+        self.bullet_client = bullet_client
+        self.counts = {}
+
+    def __getattr__(self, name):
+        attr = getattr(self.bullet_client, name)
+        if not callable(attr):
+            return attr
+        def counted_attr(*args, **kwargs):
+            self.counts[name] = self.counts.get(name, 0) + 1
+            return attr(*args, **kwargs)
+        return counted_attr
+
+def benchmark_pybullet_calls(simulator, controller, max_time=5.):
+    """
+    Counts the calls to pybullet made by simulator.run(controller, max_time)
+    (reset the simulator first, as usual).
+
+    Returns a dictionary with the number of time steps, the total number of
+    pybullet calls per time step, and the number of calls to each pybullet
+    function per time step.
+    """
+
+    bullet_client = simulator.bullet_client
+    counter = PybulletCallCounter(bullet_client)
+    actuators = simulator.actuators
+    simulator.bullet_client = counter
+    simulator.actuators = TorqueActuators(
+        counter,
+        actuators.body_id,
+        actuators.joint_ids,
+        actuators.command_names,
+        actuators.maximum_commands,
+    )
+    try:
+        simulator.run(controller, max_time=max_time)
+    finally:
+        simulator.bullet_client = bullet_client
+        simulator.actuators = actuators
+
+    number_of_time_steps = simulator.time_step
+    if number_of_time_steps == 0:
+        raise Exception('simulation stopped before taking any time steps')
+    return {
+        'number_of_time_steps': number_of_time_steps,
+        'calls_per_time_step': sum(counter.counts.values()) / number_of_time_steps,
+        'calls_per_time_step_by_function': {
+            name: count / number_of_time_steps for name, count in sorted(counter.counts.items())
+        },
+    }
 
 class Simulator:
     def __init__(
@@ -19,6 +270,7 @@ class Simulator:
             scope_noise=0.1,
             width=640,
             height=480,
+            spacecraft_urdf='spacecraft.urdf',
         ):
 
         # Random number generator
@@ -31,6 +283,9 @@ class Simulator:
         # Time step
         self.dt = dt
 
+        # Real-time pacing (used only when displaying)
+        self.pacer = RealTimePacer(self.dt, sleep_fraction=0.9)
+
         # Other parameters
         # - Maximum applied torque
         self.tau_max = 2.
@@ -73,9 +328,16 @@ class Simulator:
             enableFileCaching=0,
         )
 
-        # Load robot
+        # Load robot, either from a file in ./urdf or from a URDF string (e.g.,
+        # from ae353_spacecraft_design.get_spacecraft_urdf) - the latter is
+        # written by ae353_spacecraft_design.write_urdf to a file in ./urdf
+        # named after a hash of its content (pybullet finds the meshes only
+        # next to the URDF), and these files are not removed afterward
+        if spacecraft_urdf.lstrip().startswith('<'):
+            from ae353_spacecraft_design import write_urdf
+            spacecraft_urdf = write_urdf(spacecraft_urdf).name
         self.robot_id = self.bullet_client.loadURDF(
-            str(Path('./urdf/spacecraft.urdf')),
+            str(Path(f'./urdf/{spacecraft_urdf}')),
             basePosition=np.array([0., 0., 0.]),
             baseOrientation=self.bullet_client.getQuaternionFromEuler([0., 0., 0.]),
             useFixedBase=0,
@@ -151,6 +413,31 @@ class Simulator:
             forces=np.zeros(self.num_joints),
         )
 
+        # Prepare to apply torque commands to each robot joint
+        self.actuators = TorqueActuators(
+            self.bullet_client,
+            self.robot_id,
+            self.joint_ids,
+            ['torque_1_command', 'torque_2_command', 'torque_3_command', 'torque_4_command'],
+            self.tau_max,
+        )
+
+        # Find the direction to each reaction wheel in the body frame (used
+        # to aim the shooting star without querying link states every time)
+        o_body_in_world, q_body_in_world = self.bullet_client.getBasePositionAndOrientation(self.robot_id)
+        R_body_in_world = np.reshape(self.bullet_client.getMatrixFromQuaternion(q_body_in_world), (3, 3))
+        link_states = self.bullet_client.getLinkStates(self.robot_id, self.joint_ids)
+        self.wheel_directions_in_body = np.array([
+            link_state[0] for link_state in link_states
+        ]) - np.array(o_body_in_world)
+        self.wheel_directions_in_body = self.wheel_directions_in_body @ R_body_in_world
+        self.wheel_directions_in_body /= np.linalg.norm(self.wheel_directions_in_body, axis=1, keepdims=True)
+        self.shootingstar_respawn_time = np.inf
+
+        # Time (each run starts again from zero)
+        self.t = 0.
+        self.time_step = 0
+
         # Place stars
         with open(Path('urdf/stars.json'), 'r') as f:
             self.stars = json.load(f)
@@ -165,6 +452,13 @@ class Simulator:
                 basePosition=star['pos'].flatten(),
                 useFixedBase=1,
             )
+
+        # Stack star positions (one row per star) and preallocate buffers for
+        # image coordinates and scope noise, so star tracker measurements can
+        # be computed for all stars at once
+        self.star_positions = np.array([star['pos'].flatten() for star in self.stars]).reshape(-1, 3)
+        self.pos_in_image = np.empty((len(self.stars), 2))
+        self.scope_noise_sample = np.empty((len(self.stars), 2))
         
         # Initialize meshcat if necessary
         if self.display_meshcat:
@@ -179,38 +473,89 @@ class Simulator:
         (in 1, 2, ...), or nan if out of scope, at indices (2 * i - 2) and (2 * i - 1)
         """
         
-        # position of each star in the image frame
+        # pose of body frame in world frame
         pos, ori = self.bullet_client.getBasePositionAndOrientation(self.robot_id)
-        o_body_in_world = np.reshape(np.array(pos), (3, 1))
-        R_body_in_world = np.reshape(np.array(self.bullet_client.getMatrixFromQuaternion(ori)), (3, 3))
-        pos_in_image = []
-        for star in self.stars:
-            pos_in_body = (R_body_in_world.T @ (-o_body_in_world + star['pos'])).flatten()
-            star['y'] = (pos_in_body[1] / pos_in_body[0]) / self.scope_radius
-            star['z'] = (pos_in_body[2] / pos_in_body[0]) / self.scope_radius
-            if (star['y']**2 + star['z']**2) <= 1.:
-                pos_in_image.append([star['y'], star['z']])
-            else:
-                pos_in_image.append([np.nan, np.nan])
+        R_body_in_world = np.reshape(self.bullet_client.getMatrixFromQuaternion(ori), (3, 3))
+        return self._get_sensor_measurements(pos, R_body_in_world)
+
+    def _get_sensor_measurements(self, o_body_in_world, R_body_in_world):
+        # position of each star in the body frame (one row per star)
+        pos_in_body = (self.star_positions - o_body_in_world) @ R_body_in_world
 
-        pos_in_image = np.array(pos_in_image)
-        pos_in_image += self.scope_noise * self.rng.standard_normal(pos_in_image.shape)
+        # position of each star in the image frame (nan if out of scope)
+        pos_in_image = self.pos_in_image
+        np.divide(pos_in_body[:, 1:], pos_in_body[:, 0:1], out=pos_in_image)
+        pos_in_image /= self.scope_radius
+        pos_in_image[np.sum(pos_in_image**2, axis=1) > 1.] = np.nan
+
+        # scope noise
+        self.rng.standard_normal(out=self.scope_noise_sample)
+        pos_in_image += self.scope_noise * self.scope_noise_sample
 
         return pos_in_image.flatten()
 
+    def get_rotation_matrices(self, rpy):
+        return get_rotation_matrices(rpy)
+
+    def are_stars_in_view(self, rpy):
+        """
+        returns a 1d numpy array of length k that is True where every star is in
+        scope when the spacecraft (at the origin) has the roll, pitch, and yaw
+        angles in each of k rows of rpy - this requires no calls to pybullet
+        """
+        R_body_in_world = self.get_rotation_matrices(rpy)
+        pos_in_body = self.star_positions @ R_body_in_world
+        y = (pos_in_body[:, :, 1] / pos_in_body[:, :, 0]) / self.scope_radius
+        z = (pos_in_body[:, :, 2] / pos_in_body[:, :, 0]) / self.scope_radius
+        return np.all((y**2 + z**2) <= 1., axis=1)
+
+    def sample_initial_orientations(
+            self,
+            number_of_samples=1,
+            rpy_stddev=0.05,
+            batch_size=100,
+            max_batches=100,
+        ):
+        """
+        returns a (number_of_samples, 3) numpy array of roll, pitch, and yaw angles,
+        drawn from a normal distribution with zero mean and standard deviation
+        rpy_stddev and conditioned on every star being in scope
+
+        candidates are drawn and checked in batches of size batch_size
+        """
+        samples = []
+        number_of_valid_samples = 0
+        for i in range(max_batches):
+            rpy = rpy_stddev * self.rng.standard_normal((batch_size, 3))
+            rpy = rpy[self.are_stars_in_view(rpy)]
+            samples.append(rpy)
+            number_of_valid_samples += rpy.shape[0]
+            if number_of_valid_samples >= number_of_samples:
+                return np.concatenate(samples)[:number_of_samples]
+        raise Exception(f'Found only {number_of_valid_samples} of {number_of_samples} initial orientations ' + \
+                         'with all stars in view (try moving stars closer to the center of the scope)')
+
     def get_state(self):
-        # orientation and angular velocity of spacecraft
+        pos, vel, R_body_in_world, rpy, angvel, v = self._get_spacecraft_state()
+        return rpy, angvel, v
+
+    def _get_spacecraft_state(self):
+        """
+        returns everything about the spacecraft that is needed in each time
+        step (from one call each to get the base pose, the base velocity, and
+        the joint states)
+        """
+
+        # position, orientation, and velocity of spacecraft
         pos, ori = self.bullet_client.getBasePositionAndOrientation(self.robot_id)
-        rpy = self.bullet_client.getEulerFromQuaternion(ori)
-        vel = self.bullet_client.getBaseVelocity(self.robot_id)
+        linvel, angvel = self.bullet_client.getBaseVelocity(self.robot_id)
+        R_body_in_world, rpy = get_rotation_matrix_and_rpy(ori)
 
         # angular velocity of each reaction wheel
         joint_states = self.bullet_client.getJointStates(self.robot_id, self.joint_ids)
-        v = np.zeros(self.num_joints)
-        for i in range(self.num_joints):
-            v[i] = joint_states[i][1]
+        v = np.array([joint_state[1] for joint_state in joint_states])
 
-        return rpy, vel[1], v
+        return pos, linvel, R_body_in_world, rpy, angvel, v
 
     def set_actuator_commands(
             self,
@@ -219,43 +564,26 @@ class Simulator:
             torque_3_command,
             torque_4_command,
         ):
-        if not np.isscalar(torque_1_command):
-            raise Exception('torque_1_command must be a scalar')
-        if not np.isscalar(torque_2_command):
-            raise Exception('torque_2_command must be a scalar')
-        if not np.isscalar(torque_3_command):
-            raise Exception('torque_3_command must be a scalar')
-        if not np.isscalar(torque_4_command):
-            raise Exception('torque_4_command must be a scalar')
-        
-        torque_1 = np.clip(torque_1_command, -self.tau_max, self.tau_max)
-        torque_2 = np.clip(torque_2_command, -self.tau_max, self.tau_max)
-        torque_3 = np.clip(torque_3_command, -self.tau_max, self.tau_max)
-        torque_4 = np.clip(torque_4_command, -self.tau_max, self.tau_max)
-        self.set_joint_torque(
-            np.array([
-                torque_1,
-                torque_2,
-                torque_3,
-                torque_4,
-            ])
-        )
-        return torque_1, torque_2, torque_3, torque_4
+        tau = self.actuators.clip((
+            torque_1_command,
+            torque_2_command,
+            torque_3_command,
+            torque_4_command,
+        ))
+        self.set_joint_torque(tau)
+        return tuple(tau)
     
     def set_joint_torque(self, tau):
-        if tau.shape[0] != self.num_joints:
-            raise Exception('tau must be same length as number of joints')
-        zero_gains = tau.shape[0] * (0.,)
-        self.bullet_client.setJointMotorControlArray(
-            self.robot_id,
-            self.joint_ids,
-            self.bullet_client.TORQUE_CONTROL,
-            forces=tau,
-            positionGains=zero_gains,
-            velocityGains=zero_gains,
-        )
+        self.actuators.set_joint_torque(tau)
 
-    def place_shootingstar(self):
+    def place_shootingstar(self, t=0.):
+        """
+        Places the shooting star so that it will hit one of the reaction
+        wheels, and schedules the time at which it should be placed again.
+        The shooting star moves in a straight line at constant velocity until
+        it hits something, so the time at which it leaves a sphere of radius
+        15 around the spacecraft can be found in closed form.
+        """
         if not self.shootingstar:
             self.bullet_client.resetBasePositionAndOrientation(
                 self.shot_id,
@@ -267,20 +595,29 @@ class Simulator:
                 linearVelocity=[0., 0., 0.],
                 angularVelocity=[0., 0., 0.],
             )
+            self.shootingstar_respawn_time = np.inf
             return
 
         # Choose the position and velocity of shooting star so that
         # it will hit one of the reaction wheels
-        link_states = self.bullet_client.getLinkStates(self.robot_id, self.joint_ids)
+        # - direction p to a randomly chosen wheel in the world frame
+        pos, ori = self.bullet_client.getBasePositionAndOrientation(self.robot_id)
+        R_body_in_world = np.reshape(self.bullet_client.getMatrixFromQuaternion(ori), (3, 3))
         i = self.rng.choice([0, 1, 2, 3])
-        p = np.array(link_states[i][0])
-        p /= np.linalg.norm(p)
-        while True:
-            q = self.rng.standard_normal(size=(3))
-            q /= np.linalg.norm(q)
-            if np.linalg.norm(p - q) > 0.5:
-                break
-        v = np.cross(p, q)
+        p = R_body_in_world @ self.wheel_directions_in_body[i]
+        # - unit vectors e1 and e2 that are perpendicular to p
+        a = np.zeros(3)
+        a[np.argmin(np.abs(p))] = 1.
+        e1 = np.cross(p, a)
+        e1 /= np.linalg.norm(e1)
+        e2 = np.cross(p, e1)
+        # - velocity v = p x q, where q is a unit vector chosen at random
+        #   (uniformly) from all those with ||p - q|| > 0.5, which is the
+        #   same as cos(angle between p and q) < 0.875
+        cos_angle = self.rng.uniform(-1., 0.875)
+        sin_angle = np.sqrt(1. - cos_angle**2)
+        azimuth = self.rng.uniform(0., 2. * np.pi)
+        v = sin_angle * ((np.cos(azimuth) * e1) + (np.sin(azimuth) * e2))
         pos = (2.2 * p) - (10. * v)
         self.bullet_client.resetBasePositionAndOrientation(self.shot_id,
                                           pos,
@@ -289,6 +626,11 @@ class Simulator:
                             linearVelocity=4. * v,
                             angularVelocity=[0., 0., 0.])
 
+        # Schedule the time at which the shooting star leaves a sphere of
+        # radius 15 (position at time s after placement is 2.2 p + (4 s - 10) v
+        # with p perpendicular to v)
+        self.shootingstar_respawn_time = t + (10. + (np.sqrt(15.**2 - 2.2**2) / sin_angle)) / 4.
+
     def has_docked(self):
         pos, ori = self.bullet_client.getBasePositionAndOrientation(self.cat_id)
         return np.linalg.norm(pos) <= self.docking_radius
@@ -313,13 +655,9 @@ class Simulator:
         # Base position, orientation, and velocity
         pos = np.array([0., 0., 0.])
         if initial_conditions is None:
-            while True:
-                rpy = 0.05 * self.rng.standard_normal(3)
-                ori = self.bullet_client.getQuaternionFromEuler(rpy)
-                self.bullet_client.resetBasePositionAndOrientation(self.robot_id, pos, ori)
-                star_meas = self.get_sensor_measurements()
-                if not np.isnan(star_meas).any():
-                    break
+            rpy = self.sample_initial_orientations()[0]
+            ori = self.bullet_client.getQuaternionFromEuler(rpy)
+            self.bullet_client.resetBasePositionAndOrientation(self.robot_id, pos, ori)
             angvel = 0.05 * self.rng.standard_normal(3)
         else:
             rpy = np.array([
@@ -343,9 +681,13 @@ class Simulator:
             angularVelocity=angvel,
         )
 
-        # Shooting star position, orientation, and velocity
+        # Shooting star position, orientation, and velocity (the time at which
+        # it is placed again is measured from zero, like the time in each run)
+        self.t = 0.
+        self.time_step = 0
         self.shootingstar = space_debris
-        self.place_shootingstar()
+        self.shootingstar_respawn_time = np.inf
+        self.place_shootingstar(self.t)
 
         # Cat position, orientation, and velocity
         pos = np.array([0., 0., (self.docking_radius - self.docking_buffer) + (self.docking_speed * docking_time)])
@@ -369,118 +711,72 @@ class Simulator:
             print_debug=False
         ):
 
-        self.data = {
-            't': [],
-            'psi': [],
-            'theta': [],
-            'phi': [],
-            'w_x': [],
-            'w_y': [],
-            'w_z': [],
-            'torque_1': [],
-            'torque_2': [],
-            'torque_3': [],
-            'torque_4': [],
-            'torque_1_command': [],
-            'torque_2_command': [],
-            'torque_3_command': [],
-            'torque_4_command': [],
-            'wheel_1_velocity': [],
-            'wheel_2_velocity': [],
-            'wheel_3_velocity': [],
-            'wheel_4_velocity': [],
-            'star_meas': [],
-        }
-        self.variables_to_log = getattr(controller, 'variables_to_log', [])
-        for key in self.variables_to_log:
-            if key in self.data.keys():
-                raise Exception(f'Trying to log duplicate variable {key} (choose a different name)')
-            self.data[key] = []
+        self.logger = DataLogger([
+            't',
+            'psi',
+            'theta',
+            'phi',
+            'w_x',
+            'w_y',
+            'w_z',
+            'torque_1',
+            'torque_2',
+            'torque_3',
+            'torque_4',
+            'torque_1_command',
+            'torque_2_command',
+            'torque_3_command',
+            'torque_4_command',
+            'wheel_1_velocity',
+            'wheel_2_velocity',
+            'wheel_3_velocity',
+            'wheel_4_velocity',
+            'star_meas',
+        ], controller)
 
         # Always start from zero time
+        # - the shooting star keeps moving from where the last run (if any)
+        #   left it, so the time at which it is placed again must be shifted
+        #   by the time simulated since then
+        self.shootingstar_respawn_time -= self.time_step * self.dt
         self.t = 0.
         self.time_step = 0
         self.max_time_steps = 1 + int(max_time / self.dt)
-        self.start_time = time.time()
-
-        if video_filename is not None:
-            # Import imageio
-            imageio = importlib.import_module('imageio')
-
-            # Open video
-            fps = int(1 / self.dt)
-            if print_debug:
-                print(f'Creating a video with name {video_filename} and fps {fps}')
-            w = imageio.get_writer(video_filename,
-                                   format='FFMPEG',
-                                   mode='I',
-                                   fps=fps)
-
-            # Add first frame to video
-            rgba = self.snapshot()
-            w.append_data(rgba)
-
-        while True:
-            all_done = self.step(controller)
-
-            if self.display_meshcat or self.display_pybullet:
-                self._update_camera()
-            
-            if self.display_meshcat:
-                self.meshcat_update()
-
-            if video_filename is not None:
-                if self.time_step % 25 == 0:
-                    if print_debug:
-                        print(f' {self.time_step} / {self.max_time_steps}')
-
-                # Add frame to video
-                rgba = self.snapshot()
-                w.append_data(rgba)
-
-            if all_done:
-                break
-
-            if (self.max_time_steps is not None) and (self.time_step == self.max_time_steps):
-                break
+        self.pacer.reset()
 
-        if video_filename is not None:
-            # Close video
-            w.close()
+        # Take time steps until done
+        run_loop(
+            self,
+            lambda: self.step(controller),
+            max_time_steps=self.max_time_steps,
+            update_display=self._update_camera_and_meshcat,
+            snapshot=self.snapshot,
+            video_filename=video_filename,
+            fps=int(1 / self.dt),
+            print_every=25,
+            print_debug=print_debug,
+        )
 
+        # Save data (if necessary) and return it as numpy arrays
+        self.data = self.logger.get_lists()
         if data_filename is not None:
-            with open(data_filename, 'w') as f:
-                json.dump(self.data, f)
-
-        stop_time = time.time()
-        stop_time_step = self.time_step
-
-        elapsed_time = stop_time - self.start_time
-        elapsed_time_steps = stop_time_step
-        if (elapsed_time > 0) and print_debug:
-            print(f'Simulated {elapsed_time_steps} time steps in {elapsed_time:.4f} seconds ({(elapsed_time_steps / elapsed_time):.4f} time steps per second)')
-
-        # convert lists to numpy arrays
-        data = self.data.copy()
-        for key in data.keys():
-            data[key] = np.array(data[key])
-
-        return data
+            self.logger.save(data_filename)
+        return self.logger.get_arrays()
 
     def step(self, controller):
         # Get the current time
         self.t = self.time_step * self.dt
 
+        # Get the state
+        pos, vel, R_body_in_world, rpy, angvel, v = self._get_spacecraft_state()
+
         # Get the sensor measurements
-        star_meas = self.get_sensor_measurements()
+        star_meas = self._get_sensor_measurements(pos, R_body_in_world)
 
         # Stop if any star is out of view
         if np.isnan(star_meas).any():
             return True
 
-        # Get the state
-        rpy, angvel, v = self.get_state()
-
         # Stop if any wheel exceeds maximum velocity
         if (np.abs(v) > self.v_max).any():
             return True
@@ -507,9 +803,7 @@ class Simulator:
         )
 
         # Apply external force to keep spacecraft position fixed
-        pos, ori = self.bullet_client.getBasePositionAndOrientation(self.robot_id)
-        vel = self.bullet_client.getBaseVelocity(self.robot_id)
-        f = - 150. * np.array(pos) - 50. * np.array(vel[0])
+        f = - 150. * np.array(pos) - 50. * np.array(vel)
         self.bullet_client.applyExternalForce(
             self.robot_id,
             -1,
@@ -519,44 +813,36 @@ class Simulator:
         )
 
         # Reset shooting star
-        pos, ori = self.bullet_client.getBasePositionAndOrientation(self.shot_id)
-        if np.linalg.norm(np.array(pos)) > 15:
-            self.place_shootingstar()
+        if self.t > self.shootingstar_respawn_time:
+            self.place_shootingstar(self.t)
 
         # Log data
-        self.data['t'].append(self.t)
-        self.data['psi'].append(rpy[2])
-        self.data['theta'].append(rpy[1])
-        self.data['phi'].append(rpy[0])
-        self.data['w_x'].append(angvel[0])
-        self.data['w_y'].append(angvel[1])
-        self.data['w_z'].append(angvel[2])
-        self.data['torque_1'].append(torque_1)
-        self.data['torque_2'].append(torque_2)
-        self.data['torque_3'].append(torque_3)
-        self.data['torque_4'].append(torque_4)
-        self.data['torque_1_command'].append(torque_1_command)
-        self.data['torque_2_command'].append(torque_2_command)
-        self.data['torque_3_command'].append(torque_3_command)
-        self.data['torque_4_command'].append(torque_4_command)
-        self.data['wheel_1_velocity'].append(v[0])
-        self.data['wheel_2_velocity'].append(v[1])
-        self.data['wheel_3_velocity'].append(v[2])
-        self.data['wheel_4_velocity'].append(v[3])
-        self.data['star_meas'].append(star_meas.tolist())
-        for key in self.variables_to_log:
-            val = getattr(controller, key, np.nan)
-            if not np.isscalar(val):
-                val = val.flatten().tolist()
-            self.data[key].append(val)
+        self.logger.log(
+            self.t,
+            rpy[2],
+            rpy[1],
+            rpy[0],
+            angvel[0],
+            angvel[1],
+            angvel[2],
+            torque_1,
+            torque_2,
+            torque_3,
+            torque_4,
+            torque_1_command,
+            torque_2_command,
+            torque_3_command,
+            torque_4_command,
+            v[0],
+            v[1],
+            v[2],
+            v[3],
+            star_meas.tolist(),
+        )
 
         # Try to stay real-time
         if self.display_pybullet or self.display_meshcat:
-            t = self.start_time + (self.dt * (self.time_step + 1))
-            time_to_wait = t - time.time()
-            while time_to_wait > 0:
-                time.sleep(0.9 * time_to_wait)
-                time_to_wait = t - time.time()
+            self.pacer.wait(self.time_step + 1)
 
         # Take a simulation step
         self.bullet_client.stepSimulation()
@@ -638,17 +924,10 @@ class Simulator:
             return self.pybullet_snapshot()
     
     def _wxyz_from_xyzw(self, xyzw):
-        return np.roll(xyzw, 1)
+        return wxyz_from_xyzw(xyzw)
 
     def _convert_color(self, rgba):
-        color = int(rgba[0] * 255) * 256**2 + int(rgba[1] * 255) * 256 + int(rgba[2] * 255)
-        opacity = rgba[3]
-        transparent = opacity != 1.0
-        return {
-            'color': color,
-            'opacity': opacity,
-            'transparent': transparent,
-        }
+        return convert_color(rgba)
     
     def meshcat_lights(self):
         # As of 1/21/2025, meshcat-python has a bug that does not allow
@@ -872,6 +1151,11 @@ class Simulator:
         if self.display_meshcat:
             self.meshcat_update()
 
+    def _update_camera_and_meshcat(self):
+        self._update_camera()
+        if self.display_meshcat:
+            self.meshcat_update()
+
     def _update_camera(self):
         if self.display_pybullet or self.display_meshcat:
             if self.view == 'scopeview':
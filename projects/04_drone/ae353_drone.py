@@ -13,6 +13,8 @@ import contextlib
 import io
 from scipy.spatial.transform import Rotation
 import umsgpack
+import functools
+from ae353_core import RealTimePacer, run_loop, wxyz_from_xyzw, convert_color
 
 
 class Simulator:
@@ -35,6 +37,9 @@ class Simulator:
         # Time step
         self.dt = 0.04
 
+        # Real-time pacing (used only when displaying)
+        self.pacer = RealTimePacer(self.dt, sleep_fraction=0.9)
+
         # Whether or not to error on controller print, timeout, or inactivity
         self.error_on_print = True
         self.error_on_timeout = True
@@ -802,73 +807,34 @@ class Simulator:
             print_debug=False
         ):
 
-        start_time_for_diagnostics = time.time()
-
         if max_time is None:
             self.max_time_steps = None
         else:
             self.max_time_steps = 1 + int((max_time + self.t) / self.dt)
-        self.start_time = time.time() - self.t
-        start_time_step = self.time_step
+        self.pacer.reset(self.time_step)
 
+        # Make one video (with one frame per time step) from each view
         if videos is not None:
-            # Import imageio
-            imageio = importlib.import_module('imageio')
-
-            # Compute frames per second
-            fps = int(1 / self.dt)
-
-            # Open each video
-            for video in videos:
-                if print_debug:
-                    print(f'Creating a video from view {video['view_name']} with name {video['file_name']} and fps {fps}')
-                
-                # Create video writer
-                video['writer'] = imageio.get_writer(
-                    video['file_name'],
-                    format='FFMPEG',
-                    mode='I',
-                    fps=fps,
-                )
-
-                # Add first frame to video
-                rgba = self.snapshot(video['view_name'])
-                video['writer'].append_data(rgba)
-
-        while True:
-            all_done = self.step(print_debug=print_debug)
-
-            if self.display_meshcat:
-                self.meshcat_update()
-                self.update_drone_views()
-
-            if videos is not None:
-                if (self.time_step % 25 == 0) and print_debug:
-                    print(f' {self.time_step} / {self.max_time_steps}')
-                
-                for video in videos:
-                    # Add frame to video
-                    rgba = self.snapshot(video['view_name'])
-                    video['writer'].append_data(rgba)
-
-            if all_done:
-                break
+            videos = [
+                (video['file_name'], functools.partial(self.snapshot, video['view_name']))
+                for video in videos
+            ]
 
-            if (self.max_time_steps is not None) and (self.time_step == self.max_time_steps):
-                break
+        # Take time steps until done
+        run_loop(
+            self,
+            lambda: self.step(print_debug=print_debug),
+            max_time_steps=self.max_time_steps,
+            update_display=self._update_display,
+            videos=videos,
+            print_every=25,
+            print_debug=print_debug,
+        )
 
-        if videos is not None:
-            for video in videos:
-                # Close video
-                video['writer'].close()
-        
-        stop_time_for_diagnostics = time.time()
-        stop_time_step = self.time_step
-        elapsed_time = stop_time_for_diagnostics - start_time_for_diagnostics
-        elapsed_time_steps = stop_time_step - start_time_step
-        if (elapsed_time > 0) and print_debug:
-            print(f'Simulated {elapsed_time_steps} time steps in {elapsed_time:.4f} seconds ({(elapsed_time_steps / elapsed_time):.4f} time steps per second)')
-    
+    def _update_display(self):
+        if self.display_meshcat:
+            self.meshcat_update()
+            self.update_drone_views()
 
     def get_data(self, drone_name):
         # Try to get drone by name, returning if none exists
@@ -1101,11 +1067,7 @@ class Simulator:
 
         # try to stay real-time
         if self.display_pybullet or self.display_meshcat:
-            t = self.start_time + (self.dt * (self.time_step + 1))
-            time_to_wait = t - time.time()
-            while time_to_wait > 0:
-                time.sleep(0.9 * time_to_wait)
-                time_to_wait = t - time.time()
+            self.pacer.wait(self.time_step + 1)
 
         # take a simulation step
         self.bullet_client.stepSimulation()
@@ -1255,17 +1217,10 @@ class Simulator:
             return None
 
     def _wxyz_from_xyzw(self, xyzw):
-        return np.roll(xyzw, 1)
+        return wxyz_from_xyzw(xyzw)
 
     def _convert_color(self, rgba):
-        color = int(rgba[0] * 255) * 256**2 + int(rgba[1] * 255) * 256 + int(rgba[2] * 255)
-        opacity = rgba[3]
-        transparent = opacity != 1.0
-        return {
-            'color': color,
-            'opacity': opacity,
-            'transparent': transparent,
-        }
+        return convert_color(rgba)
     
     def meshcat_lights(self, vis):
         # As of 1/21/2025, meshcat-python has a bug that does not allow
@@ -0,0 +1,50 @@
+"""
+Copies the modules in this folder, which all simulators share, over every
+copy of them in the example and project folders.
+
+Each of those folders is handed out on its own and must run without the rest
+of this repository, so each one keeps its own copy of these modules. Change
+them only here and then run
+
+    python shared/sync.py
+
+to update every copy. With --check, this lists the copies that differ
+(without changing them) and fails if there are any - test_shared_modules.py
+does the same check. A new folder gets a module by copying it there once.
+"""
+
+from pathlib import Path
+import sys
+
+
+shared = Path(__file__).resolve().parent
+repository = shared.parent
+
+
+def get_copies():
+    """
+    returns a list of (source, copy) pairs, one for each copy of each shared
+    module outside this folder
+    """
+    copies = []
+    for source in sorted(shared.glob('ae353_*.py')):
+        for copy in sorted(repository.glob(f'**/{source.name}')):
+            if copy.parent != shared:
+                copies.append((source, copy))
+    return copies
+
+
+def main(check=False):
+    different = []
+    for source, copy in get_copies():
+        if copy.read_bytes() != source.read_bytes():
+            different.append(copy.relative_to(repository))
+            if not check:
+                copy.write_bytes(source.read_bytes())
+    for copy in different:
+        print(f'{"differs" if check else "updated"}: {copy}')
+    return 1 if (check and different) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(check=('--check' in sys.argv[1:])))
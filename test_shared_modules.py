@@ -0,0 +1,25 @@
+"""
+Each simulator folder has its own copy of the modules in shared/, so that
+every folder stays self-contained. This checks that all copies are the same
+as the ones in shared/ - after changing a module there, run
+
+    python shared/sync.py
+"""
+
+from pathlib import Path
+import pytest
+
+
+repository = Path(__file__).resolve().parent
+shared = repository / 'shared'
+
+
+@pytest.mark.parametrize('source', sorted(shared.glob('ae353_*.py')), ids=lambda source: source.name)
+def test_copies_of_shared_module_are_same_as_source(source):
+    copies = [copy for copy in sorted(repository.glob(f'**/{source.name}')) if copy.parent != shared]
+    assert len(copies) > 0
+    different = [
+        str(copy.relative_to(repository)) for copy in copies
+        if copy.read_bytes() != source.read_bytes()
+    ]
+    assert not different, f'these copies of {source.name} differ from shared/{source.name} (run python shared/sync.py): {different}'